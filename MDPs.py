@@ -3,9 +3,16 @@ Clases y funciones para definir y resolver MDPs discretos
 utilizando programación dinámica y Q-learning en forma tabular.
 
 """
+import heapq
+import math
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from inspect import signature
+from itertools import count, product
 from random import choice, random
 
+import numpy as np
+
 class MDP(metaclass=ABCMeta):
     """
     Clase para definir un MDP discreto.
@@ -21,6 +28,9 @@ class MDP(metaclass=ABCMeta):
         - prob_transicion(s, a, s')
         - es_terminal(s)
         
+    De forma opcional puede sobreescribirse sucesores(s, a) para que los
+    algoritmos no tengan que recorrer todos los estados en cada respaldo.
+        
     """
     def __init__(self, estados, gama):
         self.estados = estados
@@ -58,8 +68,282 @@ class MDP(metaclass=ABCMeta):
         """
         raise NotImplementedError("Es terminal no implementada")
     
+    def sucesores(self, s, a):
+        """
+        Devuelve una lista de tuplas (s', p, r) con los estados s' a los que
+        se llega desde s con la acción a, su probabilidad p > 0 y la 
+        recompensa r de la transición.
+        
+        Por omisión se construye a partir de prob_transicion recorriendo 
+        todos los estados, por lo que conviene sobreescribirlo cuando cada
+        acción tiene pocos sucesores.
+        
+        """
+        sucesores = []
+        for s_ in self.estados:
+            p = self.prob_transicion(s, a, s_)
+            if p > 0:
+                sucesores.append((s_, p, self.recompensa(s, a, s_)))
+        return sucesores
+    
+
+def valor_accion(mdp, s, a, V):
+    """
+    Calcula el valor esperado de aplicar la acción a en el estado s.
+    
+    Parámetros
+    ----------
+    mdp : MDP
+        MDP del que se toman las transiciones.
+    s : estado
+        Estado en el que se aplica la acción.
+    a : acción
+        Acción legal en s.
+    V : dict
+        Función de valor con la que se evalúan los sucesores.
+        
+    Devuelve
+    --------
+    q : float
+        Valor de la acción a en el estado s.
+    
+    """
+    return sum(
+        p * (r + mdp.gama * V[s_]) for s_, p, r in mdp.sucesores(s, a)
+    )
+
+class MDPCompilado(MDP):
+    """
+    Representación de un MDP en arreglos de NumPy.
+    
+    Es a su vez un MDP, por lo que puede usarse con cualquiera de los 
+    algoritmos de este módulo. Como solo guarda la recompensa esperada de
+    cada par (s, a), recompensa(s, a, s') devuelve ese valor esperado.
+    
+    Los estados se numeran según su orden en mdp.estados y cada par (s, a) 
+    con s no terminal ocupa una fila. Las filas del estado i son
+    inicio[i]:inicio[i + 1] y siguen el orden de acciones_legales(s).
+    
+    La matriz de transición P de tamaño (n_sa, n_estados) se guarda en 
+    formato CSR con los arreglos ptr, sucesor y prob. Además se guarda la 
+    fila de cada entrada para poder sumar por filas con np.bincount.
+    
+    Atributos
+    ---------
+    estados : tuple
+        Estados del MDP en el orden de su índice.
+    indice : dict
+        Asigna a cada estado su índice.
+    acciones : list
+        Tupla de acciones legales de cada estado (vacía si es terminal).
+    inicio : ndarray
+        Primer renglón (s, a) de cada estado, con n_estados + 1 entradas.
+    ptr, sucesor, prob, fila : ndarray
+        Matriz de transición en formato CSR.
+    R : ndarray
+        Recompensa esperada de cada par (s, a).
+    terminal : ndarray
+        Máscara booleana de estados terminales.
+    gama : float
+        Factor de descuento.
+    
+    """
+    def __init__(self, estados, indice, acciones, ptr, sucesor, prob, R, 
+                 terminal, gama):
+        super().__init__(estados, gama)
+        self.indice = indice
+        self.acciones = acciones
+        self.ptr = ptr
+        self.sucesor = sucesor
+        self.prob = prob
+        self.R = R
+        self.terminal = terminal
+        
+        conteo = np.array([len(acc) for acc in acciones], dtype=np.int64)
+        self.inicio = np.concatenate(([0], np.cumsum(conteo)))
+        self.fila = np.repeat(np.arange(len(R)), np.diff(ptr))
+        # Estados con al menos una acción, que son los que se respaldan
+        self.activos = np.flatnonzero(conteo)
+        self.conteo_activos = conteo[self.activos]
+        
+    def acciones_legales(self, s):
+        return self.acciones[self.indice[s]]
+    
+    def recompensa(self, s, a, s_):
+        return self.R[self.fila_sa(s, a)]
+    
+    def prob_transicion(self, s, a, s_):
+        k = self.fila_sa(s, a)
+        j = self.indice[s_]
+        entradas = slice(self.ptr[k], self.ptr[k + 1])
+        return float(self.prob[entradas][self.sucesor[entradas] == j].sum())
+    
+    def es_terminal(self, s):
+        return bool(self.terminal[self.indice[s]])
+    
+    def sucesores(self, s, a):
+        k = self.fila_sa(s, a)
+        r = float(self.R[k])
+        return [
+            (self.estados[j], p, r) for j, p in zip(
+                self.sucesor[self.ptr[k]:self.ptr[k + 1]].tolist(),
+                self.prob[self.ptr[k]:self.ptr[k + 1]].tolist()
+            )
+        ]
+    
+    def fila_sa(self, s, a):
+        """
+        Devuelve la fila que corresponde al par (s, a).
+        
+        """
+        i = self.indice[s]
+        return self.inicio[i] + self.acciones[i].index(a)
+    
+    @property
+    def n_estados(self):
+        return len(self.estados)
+    
+    @property
+    def n_sa(self):
+        return len(self.R)
+    
+    def valores_q(self, V):
+        """
+        Calcula Q(s, a) = R(s, a) + gama * sum_s' P(s'|s, a) V(s') para 
+        todas las filas (s, a) a la vez.
+        
+        """
+        esperado = np.bincount(
+            self.fila, weights=self.prob * V[self.sucesor], minlength=self.n_sa
+        )
+        return self.R + self.gama * esperado
+    
+    def maximo(self, Q):
+        """
+        Devuelve el máximo de Q por cada estado activo.
+        
+        """
+        if self.n_sa == 0:
+            return np.zeros(0)
+        return np.maximum.reduceat(Q, self.inicio[self.activos])
+    
+    def argmaximo(self, Q, Qmax=None):
+        """
+        Devuelve, por cada estado activo, la posición dentro de sus acciones
+        legales de la primera acción que alcanza el máximo.
+        
+        """
+        if Qmax is None:
+            Qmax = self.maximo(Q)
+        if self.n_sa == 0:
+            return np.zeros(0, dtype=np.int64)
+        inicio = self.inicio[self.activos]
+        posiciones = np.where(
+            Q == np.repeat(Qmax, self.conteo_activos), 
+            np.arange(self.n_sa), self.n_sa
+        )
+        return np.minimum.reduceat(posiciones, inicio) - inicio
+    
+    def politica(self, posiciones):
+        """
+        Convierte las posiciones devueltas por argmaximo en un diccionario
+        estado -> acción para los estados no terminales.
+        
+        """
+        return {
+            self.estados[i]: self.acciones[i][j] 
+            for i, j in zip(self.activos.tolist(), posiciones.tolist())
+        }
+    
+    def valores(self, V):
+        """
+        Convierte un arreglo de valores en un diccionario estado -> valor.
+        
+        """
+        return dict(zip(self.estados, V.tolist()))
+    
+    def matriz_politica(self, pi):
+        """
+        Construye la matriz de transición P_pi y la recompensa R_pi de una
+        política. Los estados sin acción en pi quedan con fila vacía.
+        
+        """
+        from scipy.sparse import csr_matrix
+        
+        filas = np.array([
+            self.fila_sa(s, pi[s]) for s in self.estados 
+            if s in pi and not self.terminal[self.indice[s]]
+        ], dtype=np.int64)
+        con_accion = np.array([
+            self.indice[s] for s in self.estados 
+            if s in pi and not self.terminal[self.indice[s]]
+        ], dtype=np.int64)
+        
+        conteo = np.zeros(self.n_estados, dtype=np.int64)
+        conteo[con_accion] = self.ptr[filas + 1] - self.ptr[filas]
+        entradas = np.concatenate([
+            np.arange(self.ptr[k], self.ptr[k + 1]) for k in filas
+        ]) if len(filas) else np.zeros(0, dtype=np.int64)
+        P = csr_matrix(
+            (self.prob[entradas], self.sucesor[entradas], 
+             np.concatenate(([0], np.cumsum(conteo)))),
+            shape=(self.n_estados, self.n_estados)
+        )
+        R = np.zeros(self.n_estados)
+        R[con_accion] = self.R[filas]
+        return P, R
+
+
+def compilar(mdp):
+    """
+    Construye la representación en arreglos de un MDP.
+    
+    Se recorren una sola vez los estados, sus acciones legales y sus 
+    sucesores, por lo que conviene que el MDP implemente sucesores(s, a).
+    
+    Parámetros
+    ----------
+    mdp : MDP
+        MDP a compilar. Si ya es un MDPCompilado se devuelve tal cual.
+        
+    Devuelve
+    --------
+    modelo : MDPCompilado
+        MDP en forma de arreglos.
+    
+    """
+    if isinstance(mdp, MDPCompilado):
+        return mdp
+    
+    estados = tuple(mdp.estados)
+    indice = {s: i for i, s in enumerate(estados)}
+    terminal = np.array([mdp.es_terminal(s) for s in estados], dtype=bool)
+    
+    acciones, ptr, sucesor, prob, R = [], [0], [], [], []
+    for s, es_terminal in zip(estados, terminal):
+        acc = () if es_terminal else tuple(mdp.acciones_legales(s))
+        acciones.append(acc)
+        for a in acc:
+            r_esperada = 0
+            for s_, p, r in mdp.sucesores(s, a):
+                sucesor.append(indice[s_])
+                prob.append(p)
+                r_esperada += p * r
+            ptr.append(len(sucesor))
+            R.append(r_esperada)
+            
+    return MDPCompilado(
+        estados, indice, acciones, 
+        ptr=np.array(ptr, dtype=np.int64), 
+        sucesor=np.array(sucesor, dtype=np.int64), 
+        prob=np.array(prob, dtype=float), 
+        R=np.array(R, dtype=float), 
+        terminal=terminal, 
+        gama=mdp.gama
+    )
 
-def valor_politica(pi, mdp, epsilon=1e-6, max_iter=1000):
+def valor_politica(pi, mdp, epsilon=1e-6, max_iter=1000, metodo='iterativo',
+                   V0=None, metricas=None):
     """
     Calcula el valor de una política pi para un MDP.
     
@@ -73,6 +357,17 @@ def valor_politica(pi, mdp, epsilon=1e-6, max_iter=1000):
         Criterio de convergencia.
     max_iter : int
         Número máximo de iteraciones.
+    metodo : str
+        'iterativo' hace barridos hasta que el cambio es menor a epsilon.
+        'lineal' resuelve (I - gama P_pi) V = R_pi sobre el MDP compilado; 
+        si el sistema es singular (por ejemplo con gama = 1 y una política
+        que nunca termina) se itera sobre la misma matriz.
+    V0 : dict
+        Valor inicial de las iteraciones. Si es None se empieza en cero.
+    metricas : Metricas
+        Registro de métricas por iteración (ver metricas.py). Con 
+        metodo='lineal' la solución directa es un solo paso que resuelve 
+        todos los estados no terminales. Opcional.
         
     Devuelve
     --------
@@ -80,27 +375,42 @@ def valor_politica(pi, mdp, epsilon=1e-6, max_iter=1000):
         Valor de la política pi.
     
     """
-    V = {s: 0 for s in mdp.estados}
+    if metodo == 'lineal':
+        return _valor_politica_lineal(pi, mdp, epsilon, max_iter, V0, 
+                                      metricas)
+    elif metodo != 'iterativo':
+        raise ValueError(f"Método desconocido: {metodo}")
     
-    for _ in range(max_iter):
-        delta = 0
+    V = {s: 0 for s in mdp.estados} if V0 is None else dict(V0)
+    if metricas is not None:
+        metricas.iniciar()
+    
+    for it in range(max_iter):
+        delta, respaldos = 0, 0
         for s in mdp.estados: 
             if not mdp.es_terminal(s):
                 v = V[s]
-                V[s] = sum(
-                    mdp.prob_transicion(s, pi[s], s_) 
-                    * (mdp.recompensa(s, pi[s], s_) + mdp.gama * V[s_])
-                    for s_ in mdp.estados
-                )
+                V[s] = valor_accion(mdp, s, pi[s], V)
                 delta = max(delta, abs(v - V[s]))
+                respaldos += 1
+        if metricas is not None:
+            metricas.registrar('valor_politica', it + 1, respaldos=respaldos,
+                               delta=delta)
         if delta < epsilon:
             break
     return V
 
-def iteracion_politica(mdp, epsilon=1e-6, max_iter=1000):
+def iteracion_politica(mdp, epsilon=1e-6, max_iter=1000, metodo='iterativo',
+                       k=None, ver_V=False, pi0=None, V0=None, metricas=None):
     """
     Calcula la política óptima para un MDP utilizando iteración de política.
     
+    Con k=None cada política se evalúa hasta converger, partiendo del valor
+    de la política anterior. Con k distinto de None se usa iteración de 
+    política modificada: cada mejora hace un respaldo de Bellman completo y
+    después solo k barridos de evaluación, y el algoritmo termina cuando el
+    respaldo de Bellman cambia V en menos de epsilon.
+    
     Parámetros
     ----------
     mdp : MDP
@@ -109,6 +419,25 @@ def iteracion_politica(mdp, epsilon=1e-6, max_iter=1000):
         Criterio de convergencia.
     max_iter : int
         Número máximo de iteraciones.
+    metodo : str
+        Método con el que se evalúa cada política (ver valor_politica).
+        Con 'lineal' el MDP se compila una sola vez al inicio.
+    k : int, str o None
+        Número de barridos de evaluación por mejora. Con 'adaptativo' se 
+        evalúa hasta que el cambio es menor a una décima parte del último 
+        cambio de Bellman, lo que da evaluaciones cortas al principio y más
+        precisas cerca del óptimo. Solo aplica con metodo='iterativo'.
+    ver_V : bool
+        Si es True, devuelve también la función de valor.
+    pi0 : dict
+        Política inicial. Los estados que no aparecen en pi0, o cuya acción
+        ya no es legal, empiezan con una acción al azar.
+    V0 : dict
+        Valor inicial de la primera evaluación. Los estados que no aparecen
+        en V0 empiezan en cero.
+    metricas : Metricas
+        Registro de métricas (ver metricas.py). Opcional. Cada mejora de la
+        política se registra después de los barridos de su evaluación.
         
     Devuelve
     --------
@@ -116,30 +445,153 @@ def iteracion_politica(mdp, epsilon=1e-6, max_iter=1000):
         Política óptima.
     
     """
-    pi = {s: choice(mdp.acciones_legales(s)) 
-          for s in mdp.estados if not mdp.es_terminal(s)}
+    if k is not None and metodo != 'iterativo':
+        raise ValueError("k solo puede usarse con metodo='iterativo'")
+    if metodo == 'lineal':
+        mdp = compilar(mdp)
+    
+    pi = {}
+    for s in mdp.estados:
+        if not mdp.es_terminal(s):
+            acciones = list(mdp.acciones_legales(s))
+            pi[s] = (pi0[s] if pi0 is not None and pi0.get(s) in acciones 
+                     else choice(acciones))
+    V = None if V0 is None else {s: V0.get(s, 0) for s in mdp.estados}
+    
+    if k is not None:
+        pi, V = _iteracion_politica_modificada(pi, mdp, epsilon, max_iter, k, V,
+                                               metricas)
+        return (pi, V) if ver_V else pi
+    
+    for it in range(max_iter):
+        V = valor_politica(pi, mdp, epsilon, max_iter, metodo, V0=V, 
+                           metricas=metricas)
+        if metodo == 'lineal':
+            cambios = _mejorar_politica(mdp, pi, V, epsilon)
+        else:
+            cambios = 0
+            for s in mdp.estados:
+                if not mdp.es_terminal(s):
+                    q = {a: valor_accion(mdp, s, a, V) 
+                         for a in mdp.acciones_legales(s)}
+                    a = max(q, key=q.get)
+                    # Solo se cambia de acción si la mejora supera el error 
+                    # de la evaluación, para no ciclar entre acciones 
+                    # empatadas
+                    if q[a] > q[pi[s]] + epsilon:
+                        pi[s] = a
+                        cambios += 1
+        if metricas is not None:
+            metricas.registrar('iteracion_politica', it + 1, 
+                               respaldos=len(pi), cambios=cambios)
+        if cambios == 0:
+            break
+    if ver_V:
+        return pi, V
+    else:
+        return pi
+
+def _mejorar_politica(modelo, pi, V, epsilon):
+    """
+    Mejora de la política sobre el MDP compilado, con los valores Q de 
+    todos los pares (s, a) en una sola operación (ver iteracion_politica).
+    Modifica pi en el lugar y devuelve el número de estados que cambiaron
+    de acción.
     
-    for _ in range(max_iter):
-        V = valor_politica(pi, mdp, epsilon, max_iter)
-        optima = True
+    """
+    Q = modelo.valores_q(np.array([V[s] for s in modelo.estados], dtype=float))
+    Qmax = modelo.maximo(Q)
+    mejor = modelo.argmaximo(Q, Qmax)
+    activos = modelo.activos.tolist()
+    actual = modelo.inicio[modelo.activos] + np.array(
+        [modelo.acciones[i].index(pi[modelo.estados[i]]) for i in activos],
+        dtype=np.int64
+    )
+    # Misma tolerancia que en el recorrido por estados
+    cambian = np.flatnonzero(Qmax > Q[actual] + epsilon).tolist()
+    for j in cambian:
+        i = activos[j]
+        pi[modelo.estados[i]] = modelo.acciones[i][mejor[j]]
+    return len(cambian)
+
+def _iteracion_politica_modificada(pi, mdp, epsilon, max_iter, k, V, metricas):
+    """
+    Iteración de política modificada (ver iteracion_politica).
+    
+    """
+    if V is None:
+        V = {s: 0 for s in mdp.estados}
+    if metricas is not None:
+        metricas.iniciar()
+    
+    for it in range(max_iter):
+        delta = 0
         for s in mdp.estados:
             if not mdp.es_terminal(s):
-                a = pi[s]
-                pi[s] = max(
-                    mdp.acciones_legales(s),
-                    key=lambda a: sum(
-                        mdp.prob_transicion(s, a, s_) 
-                        * (mdp.recompensa(s, a, s_) + mdp.gama * V[s_])
-                    for s_ in mdp.estados
-                    )
-                )
-                if a != pi[s]:
-                    estable = False
-        if estable:
+                v = V[s]
+                q = {a: valor_accion(mdp, s, a, V) 
+                     for a in mdp.acciones_legales(s)}
+                pi[s] = max(q, key=q.get)
+                V[s] = q[pi[s]]
+                delta = max(delta, abs(v - V[s]))
+        if metricas is not None:
+            metricas.registrar('iteracion_politica', it + 1, 
+                               respaldos=len(pi), delta=delta)
+        if delta < epsilon:
             break
-    return pi
+        if k == 'adaptativo':
+            V = valor_politica(pi, mdp, max(epsilon, delta / 10), max_iter, 
+                               V0=V, metricas=metricas)
+        else:
+            V = valor_politica(pi, mdp, epsilon, k, V0=V, metricas=metricas)
+    return pi, V
 
-def iteracion_valor(mdp, epsilon=1e-6, max_iter=1000, ver_V=False, debug=False):
+def _valor_politica_lineal(pi, mdp, epsilon, max_iter, V0, metricas=None):
+    """
+    Evaluación exacta de una política con un sistema lineal disperso
+    (ver valor_politica).
+    
+    """
+    import warnings
+    from scipy.sparse import identity
+    from scipy.sparse.linalg import MatrixRankWarning, spsolve
+    
+    if metricas is not None:
+        metricas.iniciar()
+    modelo = compilar(mdp)
+    n_activos = int(np.count_nonzero(~modelo.terminal))
+    P, R = modelo.matriz_politica(pi)
+    A = (identity(modelo.n_estados, format='csr') - modelo.gama * P).tocsc()
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', MatrixRankWarning)
+        try:
+            V = spsolve(A, R)
+        except (MatrixRankWarning, RuntimeError):
+            V = None
+    
+    if V is not None and np.all(np.isfinite(V)):
+        if metricas is not None:
+            metricas.registrar('valor_politica', 1, respaldos=n_activos, 
+                               delta=0.0)
+        return modelo.valores(V)
+    
+    V = (np.zeros(modelo.n_estados) if V0 is None else 
+         np.array([V0[s] for s in modelo.estados], dtype=float))
+    for it in range(max_iter):
+        V_ = R + modelo.gama * (P @ V)
+        delta = np.max(np.abs(V_ - V), initial=0)
+        V = V_
+        if metricas is not None:
+            metricas.registrar('valor_politica', it + 1, respaldos=n_activos,
+                               delta=float(delta))
+        if delta < epsilon:
+            break
+    return modelo.valores(V)
+
+def iteracion_valor(mdp, epsilon=1e-6, max_iter=1000, ver_V=False, debug=False,
+                    motor='python', criterio='delta', ver_cotas=False, V0=None,
+                    metricas=None, punto_control=None):
     """
     Calcula la política óptima para un MDP utilizando iteración de valor.
     
@@ -155,6 +607,30 @@ def iteracion_valor(mdp, epsilon=1e-6, max_iter=1000, ver_V=False, debug=False):
         Si es True, devuelve la función de valor.
     debug : bool
         Si es True, imprime el valor de delta cada 100 iteraciones.
+    motor : str
+        'python' recorre los estados uno por uno actualizando V en el lugar.
+        'numpy' compila el MDP y hace cada barrido como una sola operación
+        vectorizada sobre todos los pares (s, a).
+    criterio : str
+        'delta' termina cuando max |V_n+1 - V_n| < epsilon.
+        'span' usa las cotas de MacQueen 
+            V_n+1 + gama / (1 - gama) * min(V_n+1 - V_n) <= V* 
+            V* <= V_n+1 + gama / (1 - gama) * max(V_n+1 - V_n)
+        y termina cuando el ancho de las cotas es menor a epsilon, lo que 
+        garantiza que la política devuelta es epsilon-óptima. Requiere
+        gama < 1 y hace los barridos en forma síncrona.
+    ver_cotas : bool
+        Si es True, devuelve también un diccionario con las cotas 
+        (inferior, superior) de V* en cada estado. Solo con criterio='span'.
+    V0 : dict
+        Valor inicial, por ejemplo la solución de un MDP parecido. Los 
+        estados no terminales que no aparecen en V0 empiezan al azar.
+    metricas : Metricas
+        Registro de métricas por iteración (ver metricas.py). Opcional.
+    punto_control : PuntoControl
+        Si se da, V y el número de iteración se guardan periódicamente, y
+        si ya hay un punto de control se continúa desde él en lugar de 
+        empezar desde V0 (ver persistencia.py). Opcional.
         
     Devuelve
     --------
@@ -162,38 +638,841 @@ def iteracion_valor(mdp, epsilon=1e-6, max_iter=1000, ver_V=False, debug=False):
         Política óptima.
     
     """
-    V = {s: 0 if mdp.es_terminal(s) else random() for s in mdp.estados}
+    if criterio == 'span':
+        if mdp.gama >= 1:
+            raise ValueError("El criterio 'span' requiere gama < 1")
+    elif criterio != 'delta':
+        raise ValueError(f"Criterio desconocido: {criterio}")
+    elif ver_cotas:
+        raise ValueError("Las cotas solo se calculan con criterio='span'")
     
-    for _ in range(max_iter):
-        delta = 0
-        for s in mdp.estados:
-            if not mdp.es_terminal(s):
-                v = V[s]
-                V[s] = max(
-                    sum(
-                        mdp.prob_transicion(s, a, s_) 
-                        * (mdp.recompensa(s, a, s_) + mdp.gama * V[s_])
-                        for s_ in mdp.estados
+    if motor == 'numpy':
+        return _iteracion_valor_numpy(
+            mdp, epsilon, max_iter, ver_V, debug, criterio, ver_cotas, V0,
+            metricas, punto_control
+        )
+    elif motor != 'python':
+        raise ValueError(f"Motor desconocido: {motor}")
+    
+    V = _valor_inicial(mdp.estados, mdp.es_terminal, V0)
+    inicio = 0
+    if punto_control is not None and punto_control.existe():
+        guardado, inicio = _reanudar_valor(punto_control, len(V))
+        V.update(zip(mdp.estados, guardado.tolist()))
+    if metricas is not None:
+        metricas.iniciar()
+        respaldos = sum(1 for s in mdp.estados if not mdp.es_terminal(s))
+    
+    baja = alta = None
+    for _ in range(inicio, max_iter):
+        if criterio == 'delta':
+            delta = 0
+            for s in mdp.estados:
+                if not mdp.es_terminal(s):
+                    v = V[s]
+                    V[s] = max(
+                        valor_accion(mdp, s, a, V) 
+                        for a in mdp.acciones_legales(s)
                     )
-                    for a in mdp.acciones_legales(s)
-                )
-                delta = max(delta, abs(v - V[s]))
+                    delta = max(delta, abs(v - V[s]))
+        else:
+            V, baja, alta = _respaldo_sincrono(mdp, V)
+            delta = mdp.gama / (1 - mdp.gama) * (alta - baja)
         if debug and _ % 100 == 0:
             print(f"Iteración {_ + 1} - Delta: {delta}")
+        if metricas is not None:
+            metricas.registrar('iteracion_valor', _ + 1, respaldos=respaldos,
+                               delta=delta)
         if delta < epsilon:
             break
+        if punto_control is not None and punto_control.toca(_ + 1):
+            _guardar_valor(punto_control, [V[s] for s in mdp.estados], _ + 1)
+    
+    if ver_cotas and baja is None:
+        # El ciclo no corrió (max_iter=0, o un punto de control que ya 
+        # llegó a max_iter): un respaldo más da las cotas
+        V, baja, alta = _respaldo_sincrono(mdp, V)
     
     pi = {s: max(
         mdp.acciones_legales(s),
-        key=lambda a: sum(
-            mdp.prob_transicion(s, a, s_) 
-            * (mdp.recompensa(s, a, s_) + mdp.gama * V[s_])
-            for s_ in mdp.estados
-        )
+        key=lambda a: valor_accion(mdp, s, a, V)
     ) for s in mdp.estados if not mdp.es_terminal(s)}
+    
+    resultado = (pi,)
+    if ver_V:
+        resultado += (V,)
+    if ver_cotas:
+        k = mdp.gama / (1 - mdp.gama)
+        resultado += ({s: (V[s] + k * baja, V[s] + k * alta) for s in V},)
+    return resultado if len(resultado) > 1 else pi
+
+def _iteracion_valor_numpy(mdp, epsilon, max_iter, ver_V, debug, criterio,
+                           ver_cotas, V0, metricas, punto_control):
+    """
+    Iteración de valor sobre el MDP compilado (ver iteracion_valor).
+    
+    """
+    modelo = compilar(mdp)
+    V = np.array(list(_valor_inicial(
+        modelo.estados, modelo.es_terminal, V0
+    ).values()), dtype=float)
+    activos = modelo.activos
+    inicio = 0
+    if punto_control is not None and punto_control.existe():
+        V[:], inicio = _reanudar_valor(punto_control, len(V))
+    if metricas is not None:
+        metricas.iniciar()
+    
+    baja = alta = None
+    for _ in range(inicio, max_iter):
+        diferencias = modelo.maximo(modelo.valores_q(V)) - V[activos]
+        V[activos] += diferencias
+        if criterio == 'delta':
+            delta = np.max(np.abs(diferencias), initial=0)
+        else:
+            baja, alta = _extremos(modelo, diferencias)
+            delta = modelo.gama / (1 - modelo.gama) * (alta - baja)
+        if debug and _ % 100 == 0:
+            print(f"Iteración {_ + 1} - Delta: {delta}")
+        if metricas is not None:
+            metricas.registrar('iteracion_valor', _ + 1, 
+                               respaldos=len(activos), delta=float(delta))
+        if delta < epsilon:
+            break
+        if punto_control is not None and punto_control.toca(_ + 1):
+            _guardar_valor(punto_control, V, _ + 1)
+    
+    if ver_cotas and baja is None:
+        # El ciclo no corrió (max_iter=0, o un punto de control que ya 
+        # llegó a max_iter): un respaldo más da las cotas
+        diferencias = modelo.maximo(modelo.valores_q(V)) - V[activos]
+        V[activos] += diferencias
+        baja, alta = _extremos(modelo, diferencias)
+    
+    pi = modelo.politica(modelo.argmaximo(modelo.valores_q(V)))
+    
+    resultado = (pi,)
+    if ver_V:
+        resultado += (modelo.valores(V),)
+    if ver_cotas:
+        k = modelo.gama / (1 - modelo.gama)
+        resultado += (dict(zip(
+            modelo.estados, zip((V + k * baja).tolist(), (V + k * alta).tolist())
+        )),)
+    return resultado if len(resultado) > 1 else pi
+
+def _respaldo_sincrono(mdp, V):
+    """
+    Respaldo de Bellman síncrono de todos los estados, para el criterio 
+    'span'. Devuelve el nuevo V y la menor y la mayor diferencia con V.
+    
+    """
+    V_ = {s: V[s] if mdp.es_terminal(s) else max(
+        valor_accion(mdp, s, a, V) for a in mdp.acciones_legales(s)
+    ) for s in mdp.estados}
+    diferencias = [V_[s] - V[s] for s in mdp.estados]
+    return V_, min(diferencias), max(diferencias)
+
+def _extremos(modelo, diferencias):
+    """
+    Menor y mayor diferencia de un respaldo del motor numpy, contando los
+    estados sin acciones, que no cambian y tienen diferencia 0.
+    
+    """
+    baja = np.min(diferencias, initial=np.inf)
+    alta = np.max(diferencias, initial=-np.inf)
+    if len(diferencias) < modelo.n_estados:
+        baja, alta = min(baja, 0), max(alta, 0)
+    return baja, alta
+
+def _guardar_valor(punto_control, V, iteracion):
+    """
+    Guarda el punto de control de iteracion_valor después de la iteración
+    dada (contando desde 1).
+    
+    """
+    punto_control.guardar(
+        {'V': np.asarray(V, dtype=float)},
+        {'algoritmo': 'iteracion_valor', 'iteracion': iteracion}
+    )
+
+def _reanudar_valor(punto_control, n):
+    """
+    Devuelve (V, iteración) del punto de control de iteracion_valor.
+    
+    """
+    arreglos, metadatos = punto_control.cargar('iteracion_valor')
+    if len(arreglos['V']) != n:
+        raise ValueError("El punto de control es de un MDP con otros estados")
+    return arreglos['V'], metadatos['iteracion']
+
+def _valor_inicial(estados, es_terminal, V0):
+    """
+    Valor inicial de iteración de valor: cero en los estados terminales y 
+    V0[s], o un número al azar si no hay V0, en los demás.
+    
+    """
+    if V0 is None:
+        V0 = {}
+    return {s: 0 if es_terminal(s) else V0.get(s, random()) for s in estados}
+
+def iteracion_valor_lote(mdps, epsilon=1e-6, max_iter=1000, ver_V=False,
+                         metricas=None):
+    """
+    Resuelve con iteración de valor varios MDPs con la misma estructura a la
+    vez, por ejemplo el mismo problema con distintos rho o gama.
+    
+    Los MDPs deben tener los mismos estados y las mismas acciones legales en
+    cada estado; las probabilidades, recompensas y gama pueden cambiar. Los
+    arreglos compilados se apilan en un eje de lote y cada barrido respalda
+    todas las instancias que aún no convergen con una sola operación.
+    
+    Parámetros
+    ----------
+    mdps : list
+        MDPs a resolver.
+    epsilon : float
+        Criterio de convergencia de cada instancia.
+    max_iter : int
+        Número máximo de iteraciones.
+    ver_V : bool
+        Si es True, devuelve también las funciones de valor.
+    metricas : Metricas
+        Registro de métricas por iteración (ver metricas.py). Opcional. Los
+        respaldos cuentan todas las instancias pendientes y delta es el 
+        mayor entre ellas.
+        
+    Devuelve
+    --------
+    pis : list
+        Política óptima de cada MDP, en el mismo orden.
+    
+    """
+    modelos = [compilar(mdp) for mdp in mdps]
+    base = modelos[0]
+    for modelo in modelos[1:]:
+        if (modelo.estados != base.estados or modelo.acciones != base.acciones
+                or not np.array_equal(modelo.terminal, base.terminal)):
+            raise ValueError("Los MDPs del lote no tienen la misma estructura")
+    
+    # Patrón común de la matriz de transición: la unión de las entradas
+    # (fila, sucesor) de todas las instancias
+    n, n_sa, N = base.n_estados, base.n_sa, len(modelos)
+    claves = [modelo.fila * n + modelo.sucesor for modelo in modelos]
+    union = np.unique(np.concatenate(claves))
+    fila, sucesor = union // n, union % n
+    prob = np.zeros((N, len(union)))
+    for b, (modelo, clave) in enumerate(zip(modelos, claves)):
+        np.add.at(prob[b], np.searchsorted(union, clave), modelo.prob)
+    R = np.stack([modelo.R for modelo in modelos])
+    gama = np.array([modelo.gama for modelo in modelos], dtype=float)
+    # Fila desplazada según la posición en el lote, para sumar todas las 
+    # instancias pendientes con un solo bincount
+    fila_lote = np.arange(N)[:, None] * n_sa + fila
+    
+    activos = base.activos
+    inicio = base.inicio[activos]
+    V = np.array([
+        [0.0 if t else random() for t in base.terminal] for _ in modelos
+    ]).reshape(N, n)
+    pendientes = np.arange(N)
+    if metricas is not None:
+        metricas.iniciar()
+    
+    def valores_q(lote):
+        k = len(lote)
+        esperado = np.bincount(
+            fila_lote[:k].ravel(),
+            weights=(prob[lote] * V[lote][:, sucesor]).ravel(),
+            minlength=k * n_sa
+        ).reshape(k, n_sa)
+        return R[lote] + gama[lote, None] * esperado
+    
+    for it in range(max_iter):
+        if not len(pendientes) or not n_sa:
+            break
+        Vmax = np.maximum.reduceat(valores_q(pendientes), inicio, axis=1)
+        delta = np.max(np.abs(Vmax - V[pendientes][:, activos]), axis=1)
+        V[np.ix_(pendientes, activos)] = Vmax
+        if metricas is not None:
+            metricas.registrar('iteracion_valor_lote', it + 1, 
+                               respaldos=len(pendientes) * len(activos),
+                               delta=float(delta.max()))
+        pendientes = pendientes[delta >= epsilon]
+    
+    Q = valores_q(np.arange(N)) if n_sa else np.zeros((N, 0))
+    pis = [modelo.politica(modelo.argmaximo(q)) for modelo, q in zip(modelos, Q)]
+    if ver_V:
+        return pis, [modelo.valores(v) for modelo, v in zip(modelos, V)]
+    else:
+        return pis
+
+def iteracion_valor_prioritaria(mdp, epsilon=1e-6, max_iter=1000, 
+                                max_respaldos=None, ver_V=False, 
+                                metricas=None):
+    """
+    Calcula la política óptima con iteración de valor asíncrona por barrido
+    priorizado.
+    
+    Se construye una sola vez un índice de predecesores y se mantiene un 
+    montículo de estados ordenados por una cota de su error de Bellman. 
+    Cuando un estado cambia en d, el valor Q de cada par (s, a) que llega a
+    él con probabilidad p se corrige en gama * p * d sin recalcularlo, lo
+    que da una cota del error de Bellman de s, y solo se respaldan los 
+    estados cuya cota supera epsilon. Así no se repiten respaldos en las 
+    zonas del espacio de estados que ya convergieron.
+    
+    Trabaja sobre el MDP compilado. Para repartir el costo de cada 
+    operación de NumPy, en cada paso se respaldan juntos el estado de mayor
+    prioridad y los que tienen al menos una octava parte de ella.
+    
+    Parámetros
+    ----------
+    mdp : MDP
+        MDP para el que se calcula la política óptima.
+    epsilon : float
+        Umbral de prioridad por debajo del cual no se respalda un estado.
+    max_iter : int
+        Límite de respaldos en barridos equivalentes: se hacen a lo más 
+        max_iter veces tantos respaldos como estados no terminales, lo 
+        mismo que iteracion_valor con max_iter barridos.
+    max_respaldos : int
+        Número máximo de respaldos, si es menor que el que da max_iter.
+    ver_V : bool
+        Si es True, devuelve la función de valor.
+    metricas : Metricas
+        Registro de métricas (ver metricas.py). Opcional. Como no hay 
+        barridos, se registra cada vez que se juntan al menos tantos 
+        respaldos como estados no terminales, con delta igual al mayor 
+        cambio entre ellos.
+        
+    Devuelve
+    --------
+    pi : dict
+        Política óptima.
+    
+    """
+    modelo = compilar(mdp)
+    n, gama = modelo.n_estados, modelo.gama
+    inicio, ptr, activos = modelo.inicio, modelo.ptr, modelo.activos
+    V = np.array(list(_valor_inicial(
+        modelo.estados, modelo.es_terminal, None
+    ).values()), dtype=float)
+    
+    # Índice de predecesores en formato CSR: las entradas 
+    # ptr_pred[j]:ptr_pred[j + 1] son los pares (s, a) que llegan a j, con
+    # la probabilidad de llegar (sumada si el par llega a j varias veces)
+    estado_de = np.repeat(np.arange(n), np.diff(inicio))
+    unicas, inverso = np.unique(modelo.sucesor * modelo.n_sa + modelo.fila, 
+                                return_inverse=True)
+    sucesor_pred, fila_pred = np.divmod(unicas, modelo.n_sa)
+    gp_pred = gama * np.bincount(inverso, weights=modelo.prob)
+    ptr_pred = np.searchsorted(sucesor_pred, np.arange(n + 1))
+    estado_pred = estado_de[fila_pred]
+    
+    # Q[k] es el valor del par k con los valores actuales de los sucesores,
+    # que se corrige cada vez que uno de ellos cambia, y mejor[i] el par de
+    # la mejor acción en el último respaldo de i. La prioridad de i acota 
+    # su error de Bellman |max_k Q[k] - V[i]|: es el mayor de los 
+    # Q[k] - V[i], y de |Q[mejor[i]] - V[i]|, desde ese respaldo.
+    Q = modelo.valores_q(V)
+    Qmax = modelo.maximo(Q)
+    mejor = np.full(n, -1, dtype=np.int64)
+    mejor[activos] = inicio[activos] + modelo.argmaximo(Q, Qmax)
+    prioridad = np.zeros(n)
+    prioridad[activos] = np.abs(Qmax - V[activos])
+    
+    # Un estado entra al montículo cuando su prioridad pasa de epsilon y se
+    # vuelve a meter solo si la prioridad llega al doble de su clave (0 si
+    # no está); las entradas anteriores quedan obsoletas y se descartan al
+    # salir, así que cada estado tiene una sola entrada viva y a lo más 
+    # log2(error / epsilon) en total. El contador desempata prioridades 
+    # iguales
+    desempate = count()
+    clave = np.where(prioridad > epsilon, prioridad, 0)
+    monticulo = [(-clave[i], next(desempate), i) 
+                 for i in np.flatnonzero(clave).tolist()]
+    heapq.heapify(monticulo)
+    
+    respaldos, bloque, delta = 0, len(activos), 0
+    registrados = paso = 0
+    tope = max_iter * len(activos)
+    if max_respaldos is not None:
+        tope = min(tope, max_respaldos)
+    if metricas is not None:
+        metricas.iniciar()
+    while monticulo:
+        if respaldos >= tope:
+            break
+        # Se respaldan juntos el estado de mayor prioridad y todos los que 
+        # tienen al menos una octava parte de su prioridad
+        limite = -monticulo[0][0] / 8
+        lote = []
+        while monticulo and -monticulo[0][0] >= limite:
+            error, _, i = heapq.heappop(monticulo)
+            if clave[i] == -error:
+                clave[i] = 0
+                lote.append(i)
+        del lote[tope - respaldos:]
+        if not lote:
+            continue
+        lote = np.array(lote, dtype=np.int64)
+        prioridad[lote] = 0
+        
+        filas = _rangos(inicio, lote)
+        transiciones = _rangos(ptr, filas)
+        conteo = ptr[filas + 1] - ptr[filas]
+        q = modelo.R[filas] + gama * np.add.reduceat(
+            modelo.prob[transiciones] * V[modelo.sucesor[transiciones]], 
+            np.cumsum(conteo) - conteo
+        )
+        Q[filas] = q
+        n_acciones = inicio[lote + 1] - inicio[lote]
+        primeras = np.cumsum(n_acciones) - n_acciones
+        maximo = np.maximum.reduceat(q, primeras)
+        posiciones = np.where(q == np.repeat(maximo, n_acciones), 
+                              np.arange(len(q)), len(q))
+        mejor[lote] = filas[np.minimum.reduceat(posiciones, primeras)]
+        cambio = maximo - V[lote]
+        V[lote] = maximo
+        respaldos += len(lote)
+        if metricas is not None:
+            delta = max(delta, float(np.max(np.abs(cambio))))
+            if respaldos - registrados >= bloque:
+                paso += 1
+                metricas.registrar('iteracion_valor_prioritaria', paso, 
+                                   respaldos=respaldos - registrados, 
+                                   delta=delta)
+                registrados, delta = respaldos, 0
+        
+        cambiaron = cambio != 0
+        lote, cambio = lote[cambiaron], cambio[cambiaron]
+        entradas = _rangos(ptr_pred, lote)
+        filas, estados = fila_pred[entradas], estado_pred[entradas]
+        np.add.at(Q, filas, gp_pred[entradas] * np.repeat(
+            cambio, ptr_pred[lote + 1] - ptr_pred[lote]))
+        error = Q[filas] - V[estados]
+        error = np.where(filas == mejor[estados], np.abs(error), error)
+        np.maximum.at(prioridad, estados, error)
+        suben = estados[(prioridad[estados] > epsilon) 
+                        & (prioridad[estados] > 2 * clave[estados])]
+        for j in dict.fromkeys(suben.tolist()):
+            clave[j] = prioridad[j]
+            heapq.heappush(monticulo, (-clave[j], next(desempate), j))
+    if metricas is not None and respaldos > registrados:
+        metricas.registrar('iteracion_valor_prioritaria', paso + 1, 
+                           respaldos=respaldos - registrados, delta=delta)
+    
+    pi = modelo.politica(modelo.argmaximo(modelo.valores_q(V)))
+    if ver_V:
+        return pi, modelo.valores(V)
+    else:
+        return pi
+
+def iteracion_valor_componentes(mdp, epsilon=1e-6, max_iter=1000, ver_V=False,
+                                metricas=None):
+    """
+    Calcula la política óptima descomponiendo el grafo de transiciones en
+    componentes fuertemente conexas.
+    
+    Las componentes se resuelven en orden topológico inverso, de modo que al
+    resolver una componente ya se conoce el valor final de todos sus 
+    sucesores. Las componentes de un solo estado cuyos únicos ciclos son 
+    lazos sobre sí mismo se resuelven en forma cerrada, y las demás con 
+    iteración de valor restringida a sus estados. En un MDP casi acíclico,
+    como el camión mágico, esto equivale a una sola pasada hacia atrás.
+    
+    Parámetros
+    ----------
+    mdp : MDP
+        MDP para el que se calcula la política óptima.
+    epsilon : float
+        Criterio de convergencia dentro de cada componente.
+    max_iter : int
+        Número máximo de iteraciones dentro de cada componente.
+    ver_V : bool
+        Si es True, devuelve la función de valor.
+    metricas : Metricas
+        Registro de métricas (ver metricas.py). Opcional. Se registra cada 
+        componente resuelta, con todos sus respaldos y el último delta.
+        
+    Devuelve
+    --------
+    pi : dict
+        Política óptima.
+    
+    """
+    V = {s: 0 for s in mdp.estados}
+    transiciones = {
+        s: [(a, mdp.sucesores(s, a)) for a in mdp.acciones_legales(s)]
+        for s in mdp.estados if not mdp.es_terminal(s)
+    }
+    vecinos = {
+        s: {s_ for _, suc in transiciones.get(s, ()) 
+            for s_, p, _ in suc if p > 0}
+        for s in mdp.estados
+    }
+    
+    def valor(s, a, suc):
+        return sum(p * (r + mdp.gama * V[s_]) for s_, p, r in suc)
+    
+    if metricas is not None:
+        metricas.iniciar()
+    
+    for paso, componente in enumerate(
+            _componentes_fuertes(mdp.estados, vecinos), 1):
+        if len(componente) == 1:
+            s = componente[0]
+            if s in transiciones:
+                V[s] = _valor_con_lazo(s, transiciones[s], V, mdp.gama)
+            if metricas is not None:
+                metricas.registrar('iteracion_valor_componentes', paso, 
+                                   respaldos=int(s in transiciones), delta=0)
+            continue
+        
+        for s in componente:
+            V[s] = random()
+        respaldos = 0
+        for _ in range(max_iter):
+            delta = 0
+            for s in componente:
+                if s in transiciones:
+                    v = V[s]
+                    V[s] = max(valor(s, a, suc) for a, suc in transiciones[s])
+                    delta = max(delta, abs(v - V[s]))
+                    respaldos += 1
+            if delta < epsilon:
+                break
+        if metricas is not None:
+            metricas.registrar('iteracion_valor_componentes', paso, 
+                               respaldos=respaldos, delta=delta)
+    
+    pi = {s: max(
+        transiciones[s], key=lambda a_suc: valor(s, *a_suc)
+    )[0] for s in transiciones}
     if ver_V:
         return pi, V
     else:
         return pi
+
+def _valor_con_lazo(s, transiciones, V, gama):
+    """
+    Resuelve en forma cerrada V(s) = max_a c_a + gama p_a V(s), donde p_a es
+    la probabilidad de quedarse en s y c_a el resto del respaldo, ya 
+    conocido. La solución es max_a c_a / (1 - gama p_a).
+    
+    """
+    mejor = -math.inf
+    for _, suc in transiciones:
+        lazo, c = 0, 0
+        for s_, p, r in suc:
+            c += p * r
+            if s_ == s:
+                lazo += p
+            else:
+                c += gama * p * V[s_]
+        denominador = 1 - gama * lazo
+        if denominador > 0:
+            mejor = max(mejor, c / denominador)
+        else:
+            # Lazo seguro sin descuento: la recompensa se acumula sin fin
+            mejor = max(mejor, 0 if c == 0 else math.copysign(math.inf, c))
+    return mejor
+
+def _componentes_fuertes(nodos, vecinos):
+    """
+    Algoritmo de Tarjan sin recursión. Devuelve la lista de componentes 
+    fuertemente conexas en orden topológico inverso: cada componente aparece
+    después de todas las componentes a las que puede llegar.
+    
+    """
+    indice, bajo = {}, {}
+    pila, en_pila = [], set()
+    componentes = []
+    contador = count()
+    
+    for raiz in nodos:
+        if raiz in indice:
+            continue
+        indice[raiz] = bajo[raiz] = next(contador)
+        pila.append(raiz)
+        en_pila.add(raiz)
+        trabajo = [(raiz, iter(vecinos[raiz]))]
+        while trabajo:
+            v, hijos = trabajo[-1]
+            for w in hijos:
+                if w not in indice:
+                    indice[w] = bajo[w] = next(contador)
+                    pila.append(w)
+                    en_pila.add(w)
+                    trabajo.append((w, iter(vecinos[w])))
+                    break
+                elif w in en_pila:
+                    bajo[v] = min(bajo[v], indice[w])
+            else:
+                trabajo.pop()
+                if trabajo:
+                    u = trabajo[-1][0]
+                    bajo[u] = min(bajo[u], bajo[v])
+                if bajo[v] == indice[v]:
+                    componente = []
+                    while True:
+                        w = pila.pop()
+                        en_pila.discard(w)
+                        componente.append(w)
+                        if w == v:
+                            break
+                    componentes.append(componente)
+    return componentes
+
+def barrido_parametros(fabrica, rejilla, resolver=iteracion_valor, 
+                       procesos=None, **opciones):
+    """
+    Resuelve un MDP para cada punto de una rejilla de parámetros, repartiendo
+    los puntos entre varios procesos.
+    
+    Los resultados se devuelven conforme terminan, por lo que la función es
+    un generador. Para obtenerlos todos de una vez basta con 
+    dict(barrido_parametros(...)). Si se cierra el generador antes de 
+    terminar, solo se esperan los puntos que ya se están resolviendo.
+    
+    Parámetros
+    ----------
+    fabrica : callable
+        Construye el MDP a partir de los parámetros, por ejemplo la clase
+        CamionMagicoProb. Debe poder serializarse con pickle.
+    rejilla : dict
+        Asigna a cada nombre de parámetro la lista de valores a probar. Se 
+        resuelve el producto cartesiano de todas las listas.
+    resolver : callable
+        Algoritmo con el que se resuelve cada MDP.
+    procesos : int
+        Número de procesos. Si es None se usa el número de CPUs.
+    **opciones
+        Argumentos adicionales para resolver (epsilon, ver_V, motor, ...).
+        
+    Devuelve
+    --------
+    (clave, resultado) : tuple
+        clave es la tupla de valores de los parámetros en el orden de 
+        rejilla y resultado lo que devuelve resolver para ese punto.
+    
+    """
+    nombres = list(rejilla)
+    puntos = list(product(*(rejilla[nombre] for nombre in nombres)))
+    
+    ejecutor = ProcessPoolExecutor(max_workers=procesos)
+    try:
+        futuros = {
+            ejecutor.submit(
+                _resolver_punto, fabrica, dict(zip(nombres, punto)), 
+                resolver, opciones
+            ): punto
+            for punto in puntos
+        }
+        for futuro in as_completed(futuros):
+            yield futuros[futuro], futuro.result()
+    finally:
+        # Si se deja de iterar el generador (o falla un punto), los puntos
+        # que no han empezado se cancelan en lugar de esperarlos
+        ejecutor.shutdown(cancel_futures=True)
+
+def _resolver_punto(fabrica, parametros, resolver, opciones):
+    """
+    Tarea de cada proceso en barrido_parametros.
+    
+    """
+    return resolver(fabrica(**parametros), **opciones)
+
+def resolver_continuacion(fabrica, parametros, resolver=iteracion_valor, 
+                          **opciones):
+    """
+    Resuelve en secuencia una lista de MDPs vecinos, arrancando cada uno 
+    desde la solución del anterior.
+    
+    Cuando los parámetros cambian poco (rho, gama, una recompensa) la 
+    solución anterior ya está cerca de la nueva y el algoritmo converge en
+    una fracción de las iteraciones.
+    
+    Parámetros
+    ----------
+    fabrica : callable
+        Construye el MDP a partir de los parámetros.
+    parametros : list
+        Lista de diccionarios de parámetros, en el orden en que se resuelven.
+    resolver : callable
+        Algoritmo con el que se resuelve cada MDP. Debe aceptar V0 y ver_V;
+        si además acepta pi0 (como iteracion_politica) también se le pasa
+        la política anterior.
+    **opciones
+        Argumentos adicionales para resolver.
+        
+    Devuelve
+    --------
+    soluciones : list
+        Tuplas (parametros, pi, V) en el mismo orden que parametros.
     
-    
\ No newline at end of file
+    """
+    usa_pi0 = 'pi0' in signature(resolver).parameters
+    soluciones = []
+    pi, V = None, None
+    for punto in parametros:
+        semilla = {'V0': V, 'pi0': pi} if usa_pi0 else {'V0': V}
+        pi, V = resolver(fabrica(**punto), ver_V=True, **semilla, **opciones)
+        soluciones.append((punto, pi, V))
+    return soluciones
+
+
+def iteracion_valor_multinivel(mdp, epsilon=1e-6, max_iter=1000, factor=4,
+                               orden=None, min_nodos=16, ver_V=False,
+                               metricas=None):
+    """
+    Calcula la política óptima con iteración de valor de lo grueso a lo 
+    fino (multimalla).
+    
+    Se construye una jerarquía de MDPs reducidos, cada uno con unos factor
+    veces menos estados que el anterior, hasta llegar a min_nodos estados.
+    Cada estado del MDP reducido (un nodo) toma las acciones, recompensas y
+    probabilidades de un estado representante del MDP original, y cada 
+    sucesor s' se reparte entre los nodos que lo aproximan. Se resuelve 
+    primero el nivel más grueso y su V, interpolada a todos los estados, 
+    es el valor inicial del siguiente nivel, y así hasta el MDP original.
+    Como en los niveles gruesos la información viaja muchos estados en
+    cada barrido, el MDP original empieza cerca de V* y necesita muchas
+    menos iteraciones que empezando al azar.
+    
+    Los estados no terminales se toman en un orden en el que los estados 
+    vecinos son parecidos (como el capital del apostador o la posición del
+    camión). Los nodos del nivel l son uno de cada factor**l estados en ese
+    orden, cada sucesor se reparte entre los dos nodos vecinos en 
+    proporción a su distancia, y el valor de los estados intermedios se 
+    interpola linealmente con los mismos pesos. Los estados terminales 
+    siempre son un nodo por sí solos. Todos los niveles se resuelven con 
+    iteración de valor sobre el MDP compilado.
+    
+    Parámetros
+    ----------
+    mdp : MDP
+        MDP para el que se calcula la política óptima.
+    epsilon : float
+        Criterio de convergencia en cada nivel.
+    max_iter : int
+        Número máximo de iteraciones en cada nivel.
+    factor : int
+        Razón entre el número de estados de dos niveles consecutivos.
+    orden : callable
+        Llave con la que se ordenan los estados, como en sorted. Si es 
+        None se usa el orden de mdp.estados.
+    min_nodos : int
+        Se deja de reducir cuando un nivel tiene a lo más estos nodos.
+    ver_V : bool
+        Si es True, devuelve la función de valor.
+    metricas : Metricas
+        Registro de métricas por iteración (ver metricas.py). Opcional. Se
+        registran las iteraciones de todos los niveles, del más grueso al
+        original, cada nivel con sus propios respaldos.
+        
+    Devuelve
+    --------
+    pi : dict
+        Política óptima.
+    
+    """
+    modelo = compilar(mdp)
+    V = None
+    for representante, columna, peso in reversed(
+            _niveles(modelo, factor, orden, min_nodos)):
+        reducido = _mdp_reducido(modelo, representante, columna, peso)
+        V0 = None if V is None else dict(enumerate(V[representante].tolist()))
+        _, V_reducido = _iteracion_valor_numpy(
+            reducido, epsilon, max_iter, True, False, 'delta', False, V0, 
+            metricas, None
+        )
+        V_reducido = np.array(list(V_reducido.values()))
+        # Interpolación a todos los estados del MDP original
+        V = (peso * V_reducido[columna]).sum(axis=1)
+    
+    V0 = None if V is None else modelo.valores(V)
+    return _iteracion_valor_numpy(
+        modelo, epsilon, max_iter, ver_V, False, 'delta', False, V0, 
+        metricas, None
+    )
+
+def _niveles(modelo, factor, orden, min_nodos):
+    """
+    Devuelve los niveles de iteracion_valor_multinivel, del más fino al más
+    grueso. Cada nivel es una tupla (representante, columna, peso): el 
+    estado representante de cada nodo y, para cada estado del modelo, los 
+    dos nodos que lo aproximan y sus pesos (arreglos de n_estados x 2).
+    
+    """
+    n = modelo.n_estados
+    no_terminales = np.flatnonzero(~modelo.terminal)
+    terminales = np.flatnonzero(modelo.terminal)
+    if orden is not None:
+        no_terminales = np.array(
+            sorted(no_terminales.tolist(), 
+                   key=lambda i: orden(modelo.estados[i])), 
+            dtype=np.int64
+        )
+    m = len(no_terminales)
+    posicion = np.arange(m)
+    niveles = []
+    anterior = m
+    nivel = 1
+    while anterior > min_nodos:
+        k = factor**nivel
+        nodos = np.unique(np.append(posicion[::k], m - 1))
+        n_nodos = len(nodos)
+        if n_nodos >= anterior:
+            break
+        abajo = posicion // k
+        arriba = np.minimum(abajo + 1, n_nodos - 1)
+        ancho = nodos[arriba] - nodos[abajo]
+        t = (posicion - nodos[abajo]) / np.maximum(ancho, 1)
+        
+        columna = np.empty((n, 2), dtype=np.int64)
+        peso = np.zeros((n, 2))
+        columna[no_terminales] = np.column_stack((abajo, arriba))
+        peso[no_terminales] = np.column_stack((1 - t, t))
+        columna[terminales] = (n_nodos + np.arange(len(terminales)))[:, None]
+        peso[terminales, 0] = 1
+        representante = np.concatenate((no_terminales[nodos], terminales))
+        niveles.append((representante, columna, peso))
+        anterior = n_nodos
+        nivel += 1
+    return niveles
+
+def _mdp_reducido(modelo, representante, columna, peso):
+    """
+    Construye el MDP compilado de un nivel de iteracion_valor_multinivel: 
+    el nodo j tiene las filas (s, a) de representante[j], y cada 
+    transición a s' se divide en dos, hacia columna[s'] con probabilidad 
+    p * peso[s'].
+    
+    """
+    filas = _rangos(modelo.inicio, representante)
+    transiciones = _rangos(modelo.ptr, filas)
+    sucesor = modelo.sucesor[transiciones]
+    conteo = np.diff(modelo.ptr)[filas]
+    
+    estados = tuple(range(len(representante)))
+    return MDPCompilado(
+        estados, {j: j for j in estados}, 
+        [modelo.acciones[i] for i in representante.tolist()],
+        ptr=2 * np.concatenate(([0], np.cumsum(conteo))), 
+        sucesor=columna[sucesor].ravel(), 
+        prob=(modelo.prob[transiciones, None] * peso[sucesor]).ravel(), 
+        R=modelo.R[filas], 
+        terminal=modelo.terminal[representante], 
+        gama=modelo.gama
+    )
+
+def _rangos(inicio, indices):
+    """
+    Concatena los rangos inicio[i]:inicio[i + 1] de los índices dados.
+    
+    """
+    conteo = inicio[indices + 1] - inicio[indices]
+    desplazamiento = np.repeat(inicio[indices] - np.cumsum(conteo) + conteo, conteo)
+    return desplazamiento + np.arange(conteo.sum())
@@ -3,13 +3,151 @@ Modulo com modelo de simulaciñon de MDPs y algoritmos de RL
 
 """
 
+import multiprocessing as mp
+import queue
+import traceback
 from abc import ABCMeta, abstractmethod
+from array import array
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from functools import partial
+from itertools import chain
+from operator import length_hint
 from random import choice, random
 
+import numpy as np
+
+class FuenteAleatoria:
+    """
+    Fuente de números aleatorios reproducible para los simuladores y los 
+    algoritmos de aprendizaje.
+    
+    Los números se sacan en bloques grandes de un Generator de NumPy y se 
+    entregan uno por uno con random(), que es una llamada a next sobre un 
+    iterador de C, así que cuesta casi lo mismo que random.random() y mucho
+    menos que pedirle a NumPy un número a la vez. Los métodos *_lote piden 
+    los arreglos directamente al generador.
+    
+    Con la misma semilla se obtiene la misma secuencia, y engendrar(n) 
+    devuelve n fuentes con flujos independientes, por ejemplo una por 
+    proceso. El estado completo se puede guardar con estado() y recuperar 
+    con restaurar(), y también se conserva al serializar con pickle.
+    
+    """
+    def __init__(self, semilla=None, tam_bloque=65536):
+        """
+        Parámetros:
+            semilla: entero, None o np.random.SeedSequence
+            tam_bloque: cantidad de números que se sacan de una vez
+        
+        """
+        if not isinstance(semilla, np.random.SeedSequence):
+            semilla = np.random.SeedSequence(semilla)
+        self.semilla = semilla
+        self.generador = np.random.default_rng(semilla)
+        self.tam_bloque = tam_bloque
+        self._reiniciar_bloques()
+    
+    def _reiniciar_bloques(self):
+        self._estado_bloque = None
+        self._bloque = None
+        self.random = partial(next, chain.from_iterable(self._bloques()))
+    
+    def _bloques(self):
+        while True:
+            # Se guarda el estado previo a cada bloque para poder reproducirlo
+            self._estado_bloque = self.generador.bit_generator.state
+            self._bloque = iter(self.generador.random(self.tam_bloque).tolist())
+            yield self._bloque
+    
+    def estado(self):
+        """
+        Devuelve un diccionario con el estado completo de la fuente.
+        
+        """
+        return {
+            'generador': self.generador.bit_generator.state,
+            'bloque': self._estado_bloque,
+            'usados': (0 if self._bloque is None else 
+                       self.tam_bloque - length_hint(self._bloque)),
+        }
+    
+    def restaurar(self, estado):
+        """
+        Regresa la fuente al estado devuelto por estado().
+        
+        """
+        self._reiniciar_bloques()
+        if estado['bloque'] is not None:
+            self.generador.bit_generator.state = estado['bloque']
+            for _ in range(estado['usados']):
+                self.random()
+        self.generador.bit_generator.state = estado['generador']
+    
+    def __getstate__(self):
+        return {'semilla': self.semilla, 'tam_bloque': self.tam_bloque,
+                'estado': self.estado()}
+    
+    def __setstate__(self, estado):
+        self.__init__(estado['semilla'], estado['tam_bloque'])
+        self.restaurar(estado['estado'])
+    
+    def randint(self, a, b):
+        """
+        Devuelve un entero uniforme en [a, b], como random.randint.
+        
+        """
+        return a + int(self.random() * (b - a + 1))
+    
+    def choice(self, secuencia):
+        """
+        Devuelve un elemento uniforme de la secuencia, como random.choice.
+        
+        """
+        return secuencia[int(self.random() * len(secuencia))]
+    
+    def random_lote(self, n):
+        """
+        Devuelve un arreglo con n números uniformes en [0, 1).
+        
+        """
+        return self.generador.random(n)
+    
+    def randint_lote(self, a, b, n):
+        """
+        Devuelve un arreglo con n enteros uniformes en [a, b].
+        
+        """
+        return self.generador.integers(a, b, size=n, endpoint=True)
+    
+    def engendrar(self, n):
+        """
+        Devuelve una lista de n fuentes independientes de esta.
+        
+        """
+        return [
+            FuenteAleatoria(semilla, self.tam_bloque) 
+            for semilla in self.semilla.spawn(n)
+        ]
+
 class MDPsim(metaclass=ABCMeta):
-    def __init__(self, estados, gama):
+    """
+    Clase para definir un MDP que solo se conoce por simulación.
+    
+    Los métodos *_lote reciben y devuelven arreglos de NumPy y permiten 
+    simular varios episodios a la vez. Por omisión llaman a la versión de 
+    un solo estado con un ciclo, así que conviene sobreescribirlos con 
+    operaciones vectorizadas.
+    
+    Para que las simulaciones sean reproducibles, las subclases deben sacar
+    sus números aleatorios de self.rng, una FuenteAleatoria.
+    
+    """
+    def __init__(self, estados, gama, rng=None):
         self.estados = estados
         self.gama = gama
+        self.rng = FuenteAleatoria() if rng is None else rng
         
     @abstractmethod
     def estado_inicial(self):
@@ -49,8 +187,390 @@ class MDPsim(metaclass=ABCMeta):
         
         """
         return False
+    
+    def estado_inicial_lote(self, n):
+        """
+        Devuelve un arreglo con n estados iniciales.
+        
+        """
+        return _arreglo([self.estado_inicial() for _ in range(n)])
+    
+    def transicion_lote(self, S, A):
+        """
+        Devuelve el arreglo de estados S' al aplicar A[i] en S[i].
+        
+        """
+        return _arreglo([
+            self.transicion(s, a) for s, a in zip(S.tolist(), A.tolist())
+        ])
+    
+    def recompensa_lote(self, S, A, S_):
+        """
+        Devuelve el arreglo de recompensas de las transiciones S, A, S'.
+        
+        """
+        return np.array([
+            self.recompensa(s, a, s_) 
+            for s, a, s_ in zip(S.tolist(), A.tolist(), S_.tolist())
+        ], dtype=float)
+    
+    def es_terminal_lote(self, S):
+        """
+        Devuelve un arreglo booleano con los estados de S que son terminales.
+        
+        """
+        return np.array([self.es_terminal(s) for s in S.tolist()], dtype=bool)
+
+class QTabla(MutableMapping):
+    """
+    Tabla Q guardada en un arreglo con índices enteros para estados y acciones.
+    
+    Cada estado ocupa un renglón de valores. Si casi todos los estados tienen
+    las mismas acciones (como en el camión mágico) la tabla es densa: cada
+    renglón tiene una entrada por cada acción del MDP y las ilegales valen 
+    -inf. Si las acciones cambian de un estado a otro (como las apuestas del
+    jugador) los renglones tienen longitud variable, en formato CSR, y solo 
+    guardan las acciones legales.
+    
+    Los valores se guardan en un array('d'), que es compacto y rápido para 
+    leer y escribir de uno en uno, y arreglo es una vista de NumPy sobre la
+    misma memoria para las operaciones vectorizadas. Para el resto del 
+    código la tabla se comporta como un diccionario {(s, a): Q(s, a)}.
+    
+    Atributos:
+        estados: tupla con los estados
+        indice: diccionario estado -> renglón
+        acciones: tupla con todas las acciones del MDP
+        codigo: diccionario acción -> columna
+        denso: True si todos los renglones tienen una entrada por acción
+        inicio: arreglo con la primera entrada de cada renglón (n + 1)
+        columna: arreglo con la columna (acción) de cada entrada
+        legal: máscara booleana de las entradas que son acciones legales
+        valores: array('d') con los valores de Q
+        arreglo: vista de NumPy de valores
+        legales: posiciones de las acciones legales de cada renglón
+        accion_en: lista con la acción de cada posición
+        mejor: posición de la acción greedy de cada renglón (-1 si no hay)
+        visitas: array('q') con el número de actualizaciones de cada entrada
+    
+    Las listas legales, accion_en y mejor son cachés de Python para el ciclo
+    de aprendizaje: elegir la acción greedy o el máximo de un renglón cuesta
+    O(1) porque mejor se mantiene al día en actualizar. Si se escribe
+    directamente en arreglo hay que llamar después a recalcular_mejor.
+    
+    """
+    def __init__(self, mdp, inicial=0.0, denso=None):
+        """
+        Parámetros:
+            mdp: objeto de la clase MDPsim
+            inicial: valor inicial de Q, o función sin argumentos que se 
+                llama una vez por entrada (por ejemplo random)
+            denso: fuerza el formato; si es None se elige denso cuando 
+                desperdicia a lo más la mitad de las entradas
+        
+        """
+        self.estados = tuple(mdp.estados)
+        self.indice = {s: i for i, s in enumerate(self.estados)}
+        
+        acciones, codigo, renglones = [], {}, []
+        for s in self.estados:
+            renglon = []
+            if not mdp.es_terminal(s):
+                for a in mdp.acciones_legales(s):
+                    if a not in codigo:
+                        codigo[a] = len(acciones)
+                        acciones.append(a)
+                    renglon.append(codigo[a])
+            renglones.append(renglon)
+        self.acciones = tuple(acciones)
+        self.codigo = codigo
+        
+        n, n_acciones = len(self.estados), len(acciones)
+        n_legales = sum(len(renglon) for renglon in renglones)
+        self.denso = n * n_acciones <= 2 * n_legales if denso is None else denso
+        if self.denso:
+            self.inicio = np.arange(n + 1, dtype=np.int64) * n_acciones
+            self.columna = np.tile(np.arange(n_acciones, dtype=np.int64), n)
+            self.legal = np.zeros(n * n_acciones, dtype=bool)
+            for i, renglon in enumerate(renglones):
+                self.legal[self.inicio[i] + np.array(renglon, dtype=np.int64)] = True
+        else:
+            self.inicio = np.concatenate(([0], np.cumsum(
+                [len(renglon) for renglon in renglones], dtype=np.int64
+            )))
+            self.columna = np.array(
+                [g for renglon in renglones for g in renglon], dtype=np.int64
+            )
+            self.legal = np.ones(n_legales, dtype=bool)
+        
+        self.valores = array('d', [-np.inf]) * len(self.columna)
+        self.visitas = array('q', [0]) * len(self.columna)
+        self.arreglo = np.frombuffer(self.valores)
+        self.arreglo[self.legal] = (
+            [inicial() for _ in range(n_legales)] if callable(inicial) 
+            else inicial
+        )
+        self._preparar()
+    
+    @classmethod
+    def desde_arreglos(cls, estados, acciones, inicio, columna, legal, 
+                       valores, visitas=None, denso=False):
+        """
+        Construye una tabla a partir de sus arreglos, sin el MDP, por 
+        ejemplo al cargarla de disco (ver persistencia.py). Los arreglos se
+        copian.
+        
+        """
+        Q = cls.__new__(cls)
+        Q.estados, Q.acciones, Q.denso = tuple(estados), tuple(acciones), denso
+        Q.indice = {s: i for i, s in enumerate(Q.estados)}
+        Q.codigo = {a: g for g, a in enumerate(Q.acciones)}
+        Q.inicio = np.array(inicio, dtype=np.int64)
+        Q.columna = np.array(columna, dtype=np.int64)
+        Q.legal = np.array(legal, dtype=bool)
+        Q.valores = array('d', np.asarray(valores, dtype=float).tobytes())
+        Q.visitas = array('q', bytes(8 * len(Q.columna)) if visitas is None 
+                          else np.asarray(visitas, dtype=np.int64).tobytes())
+        Q.arreglo = np.frombuffer(Q.valores)
+        Q._preparar()
+        return Q
+    
+    def _preparar(self):
+        """
+        Construye las cachés de Python a partir de los arreglos.
+        
+        """
+        self._inicio = self.inicio.tolist()
+        self.legales = [
+            (inicio + np.flatnonzero(self.legal[inicio:fin])).tolist() 
+            if self.denso else range(inicio, fin)
+            for inicio, fin in zip(self._inicio, self._inicio[1:])
+        ]
+        self.accion_en = [self.acciones[g] for g in self.columna.tolist()]
+        self.mejor = []
+        self.recalcular_mejor()
+    
+    def __getstate__(self):
+        estado = self.__dict__.copy()
+        del estado['arreglo']
+        return estado
+    
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self.arreglo = np.frombuffer(self.valores)
+    
+    def posicion(self, s, a):
+        """
+        Devuelve la posición en valores del par (s, a).
+        
+        """
+        i, g = self.indice[s], self.codigo[a]
+        inicio, fin = self.inicio[i], self.inicio[i + 1]
+        if self.denso:
+            k = inicio + g
+        else:
+            j = np.flatnonzero(self.columna[inicio:fin] == g)
+            k = inicio + j[0] if len(j) else fin
+        if k >= fin or not self.legal[k]:
+            raise KeyError((s, a))
+        return int(k)
+    
+    def posiciones(self, i):
+        """
+        Devuelve la lista de posiciones de las acciones legales del renglón i.
+        
+        """
+        return list(self.legales[i])
+    
+    def accion(self, k):
+        """
+        Devuelve la acción de la entrada en la posición k.
+        
+        """
+        return self.accion_en[k]
+    
+    def actualizar(self, i, k, valor):
+        """
+        Asigna valor a la posición k del renglón i y mantiene al día la 
+        acción greedy del renglón.
+        
+        """
+        valores, m = self.valores, self.mejor[i]
+        anterior = valores[k]
+        valores[k] = valor
+        if k == m:
+            if valor < anterior:
+                inicio, fin = self._inicio[i], self._inicio[i + 1]
+                renglon = valores[inicio:fin]
+                self.mejor[i] = inicio + renglon.index(max(renglon))
+        elif valor > valores[m]:
+            self.mejor[i] = k
+    
+    def recalcular_mejor(self):
+        """
+        Recalcula la acción greedy de todos los renglones.
+        
+        """
+        n = len(self.estados)
+        conteo = np.diff(self.inicio)
+        mejor = np.full(n, -1, dtype=np.int64)
+        no_vacios = np.flatnonzero(conteo)
+        if len(no_vacios):
+            inicio = self.inicio[no_vacios]
+            maximo = np.maximum.reduceat(self.arreglo, inicio)
+            posiciones = np.where(
+                self.arreglo == np.repeat(maximo, conteo[no_vacios]),
+                np.arange(len(self.arreglo)), len(self.arreglo)
+            )
+            mejor[no_vacios] = np.minimum.reduceat(posiciones, inicio)
+        sin_legales = [i for i, legales in enumerate(self.legales) if not legales]
+        mejor[sin_legales] = -1
+        self.mejor[:] = mejor.tolist()
+    
+    def politica(self):
+        """
+        Devuelve la política greedy {s: a} en los estados con acciones.
+        
+        """
+        return {s: self.accion_en[k] 
+                for s, k in zip(self.estados, self.mejor) if k >= 0}
+    
+    def como_dict(self):
+        """
+        Devuelve una copia de la tabla como diccionario {(s, a): Q(s, a)}.
+        
+        """
+        return dict(self.items())
+    
+    def __getitem__(self, clave):
+        return self.valores[self.posicion(*clave)]
+    
+    def __setitem__(self, clave, valor):
+        self.actualizar(self.indice[clave[0]], self.posicion(*clave), valor)
+    
+    def __delitem__(self, clave):
+        raise TypeError("No se pueden borrar entradas de una QTabla")
+    
+    def __iter__(self):
+        for s, legales in zip(self.estados, self.legales):
+            for k in legales:
+                yield (s, self.accion_en[k])
+    
+    def __len__(self):
+        return int(np.count_nonzero(self.legal))
+    
+    def __contains__(self, clave):
+        try:
+            self.posicion(*clave)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+class MonitorConvergencia:
+    """
+    Monitor de convergencia para los algoritmos de aprendizaje.
+    
+    El algoritmo llama a episodio(Q) al final de cada episodio. Cada cada 
+    episodios el monitor compara la tabla con la de la revisión anterior: 
+    cuántos estados cambiaron de acción greedy y el máximo |ΔQ|, con 
+    operaciones vectorizadas, así que el costo por paso es despreciable. 
+    Cuando la política greedy no ha cambiado en paciencia episodios (y el 
+    máximo |ΔQ| de la ventana es menor que tolerancia, si se da) episodio 
+    devuelve True y el algoritmo termina.
+    
+    Si se da la solución de programación dinámica del mismo problema (la 
+    política y el valor que devuelve MDPs.iteracion_valor), cada revisión 
+    también registra la fracción de estados cuya acción greedy difiere de 
+    pi_ref (sin contar empates) y el máximo |max_a Q(s, a) - V_ref(s)| 
+    sobre los estados con acciones.
+    
+    Atributos:
+        episodios: número de episodios observados
+        historial: lista de diccionarios, uno por revisión
+        ventana: las últimas revisiones (a lo más ventana)
+        detenido: True si el monitor pidió terminar
+    
+    """
+    def __init__(self, paciencia=1000, ventana=10, cada=10, tolerancia=None,
+                 pi_ref=None, V_ref=None):
+        """
+        Parámetros:
+            paciencia: episodios sin cambios en la política para terminar
+            ventana: número de revisiones que se consideran para tolerancia
+            cada: episodios entre revisiones
+            tolerancia: cota para el máximo |ΔQ| de la ventana (opcional)
+            pi_ref: política de referencia {s: a} (opcional)
+            V_ref: valor de referencia {s: V} (opcional)
+        
+        """
+        self.paciencia, self.cada, self.tolerancia = paciencia, cada, tolerancia
+        self.pi_ref, self.V_ref = pi_ref, V_ref
+        self.tam_ventana = ventana
+        self.episodios, self.estable_desde = 0, 0
+        self.historial, self.ventana = [], []
+        self.detenido = False
+        self._mejor = self._valores = None
+    
+    def episodio(self, Q):
+        """
+        Registra el final de un episodio. Devuelve True si hay que terminar.
+        
+        """
+        self.episodios += 1
+        if self.episodios % self.cada:
+            return False
+        
+        mejor = np.array(Q.mejor)
+        if self._mejor is None:
+            self._preparar(Q)
+            cambios, delta = len(mejor), np.inf
+        else:
+            distintos = self._mejor != mejor
+            cambios = int(np.count_nonzero(
+                Q.arreglo[self._mejor[distintos]] != Q.arreglo[mejor[distintos]]
+            ))
+            diferencia = np.abs(Q.arreglo[Q.legal] - self._valores)
+            delta = float(diferencia.max()) if len(diferencia) else 0.0
+        self._mejor, self._valores = mejor, Q.arreglo[Q.legal]
+        if cambios:
+            self.estable_desde = self.episodios
+        
+        registro = {'episodio': self.episodios, 'cambios': cambios, 
+                    'delta': delta}
+        if self.pi_ref is not None:
+            con_ref = self._ref_mejor >= 0
+            registro['distancia_pi'] = float(np.mean(
+                Q.arreglo[self._ref_mejor[con_ref]] < Q.arreglo[mejor[con_ref]]
+            )) if con_ref.any() else 0.0
+        if self.V_ref is not None:
+            con_acciones = mejor >= 0
+            registro['distancia_V'] = float(np.abs(
+                Q.arreglo[mejor[con_acciones]] - self._ref_V[con_acciones]
+            ).max()) if con_acciones.any() else 0.0
+        self.historial.append(registro)
+        self.ventana = self.historial[-self.tam_ventana:]
+        
+        self.detenido = self.episodios - self.estable_desde >= self.paciencia
+        if self.tolerancia is not None:
+            self.detenido = self.detenido and max(
+                r['delta'] for r in self.ventana) < self.tolerancia
+        return self.detenido
+    
+    def _preparar(self, Q):
+        """
+        Pasa las referencias al orden de los renglones de Q.
+        
+        """
+        if self.pi_ref is not None:
+            self._ref_mejor = np.array([
+                Q.posicion(s, self.pi_ref[s]) 
+                if Q.mejor[i] >= 0 and s in self.pi_ref else -1
+                for i, s in enumerate(Q.estados)
+            ])
+        if self.V_ref is not None:
+            self._ref_V = np.array([self.V_ref.get(s, 0.0) for s in Q.estados])
 
-def TD0(mdp, politica, alfa, n_ep, n_iter):
+def TD0(mdp, politica, alfa, n_ep, n_iter, metricas=None):
     """
     Algoritmo de TD(0) para estimar la función de valor de un MDP.
     
@@ -60,38 +580,60 @@ def TD0(mdp, politica, alfa, n_ep, n_iter):
         alfa: tasa de aprendizaje
         n_ep: número máximo de episodios
         n_iter: número máximo de iteraciones por episodio
+        metricas: registro de métricas por episodio (ver metricas.py)
     
     """
     V = {s: 0 for s in mdp.estados}
+    if metricas is not None:
+        metricas.iniciar()
     
-    for _ in range(n_ep):
+    for ep in range(n_ep):
         s = mdp.estado_inicial()
-        for _ in range(n_iter):
+        retorno = 0
+        for t in range(1, n_iter + 1):
             a = politica[s]
             s_ = mdp.transicion(s, a)
-            V[s] += alfa * (mdp.recompensa(s, a, s_) + mdp.gama * V[s_] - V[s])
+            r = mdp.recompensa(s, a, s_)
+            retorno += r
+            V[s] += alfa * (r + mdp.gama * V[s_] - V[s])
             if mdp.es_terminal(s_):
                 break
             s = s_  
+        if metricas is not None:
+            metricas.registrar('TD0', ep + 1, longitud=t, retorno=retorno)
     return V
 
-def politica_e_greedy(Q, s, acciones, epsilon):
+def politica_e_greedy(Q, s, acciones, epsilon, rng=None):
     """
     Política epsilon-greedy.
     
     Parámetros:
-        Q: diccionario con la función de valor Q
+        Q: diccionario o QTabla con la función de valor Q
         s: estado
         acciones: lista con las acciones legales
         epsilon: probabilidad de exploración
+        rng: FuenteAleatoria; si es None se usa el módulo random
     
     """
-    if random() < epsilon:
-        return choice(acciones)
+    if (random() if rng is None else rng.random()) < epsilon:
+        return choice(acciones) if rng is None else rng.choice(acciones)
+    elif isinstance(Q, QTabla):
+        return Q.accion_en[Q.mejor[Q.indice[s]]]
     else:
         return max(acciones, key=lambda a: Q[(s, a)])
 
-def SARSA(mdp, epsilon, alfa, n_ep, n_iter):
+def _e_greedy(Q, i, epsilon, rng):
+    """
+    Política epsilon-greedy sobre una QTabla. Devuelve la posición de la 
+    acción elegida en el renglón i.
+    
+    """
+    if rng.random() < epsilon:
+        return rng.choice(Q.legales[i])
+    return Q.mejor[i]
+
+def SARSA(mdp, epsilon, alfa, n_ep, n_iter, rng=None, Q0=None, 
+          monitor=None, metricas=None, punto_control=None):
     """
     Algoritmo SARSA para estimar la función de valor de un MDP.
     
@@ -101,27 +643,58 @@ def SARSA(mdp, epsilon, alfa, n_ep, n_iter):
         alfa: tasa de aprendizaje
         n_ep: número de episodios
         n_iter: número de iteraciones
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        Q0: QTabla desde la que se continúa el aprendizaje (se modifica)
+        monitor: MonitorConvergencia que puede terminar antes (opcional)
+        metricas: registro de métricas por episodio (ver metricas.py)
+        punto_control: PuntoControl en el que se guardan Q, el episodio y 
+            el estado de rng y mdp.rng; si ya existe se continúa desde él
+            (ver persistencia.py)
+    
+    Devuelve una QTabla, que se usa igual que el diccionario {(s, a): Q}.
     
     """
-    Q = {(s, a): random() 
-         for s in mdp.estados if not mdp.es_terminal(s) 
-         for a in mdp.acciones_legales(s)}
+    if rng is None:
+        rng = FuenteAleatoria()
+    Q = QTabla(mdp, inicial=rng.random) if Q0 is None else Q0
+    valores, visitas, indice, accion = Q.valores, Q.visitas, Q.indice, Q.accion_en
+    inicio = 0
+    if punto_control is not None and punto_control.existe():
+        inicio = _reanudar(punto_control, 'SARSA', Q, rng, mdp)
         
-    for _ in range(n_ep):
+    if metricas is not None:
+        metricas.iniciar()
+    
+    for ep in range(inicio, n_ep):
         s = mdp.estado_inicial()
-        a = politica_e_greedy(Q, s, mdp.acciones_legales(s), epsilon)
-        for _ in range(n_iter):
+        i = indice[s]
+        k = _e_greedy(Q, i, epsilon, rng)
+        retorno = 0
+        for t in range(1, n_iter + 1):
+            a = accion[k]
             s_ = mdp.transicion(s, a)
             r = mdp.recompensa(s, a, s_)
+            retorno += r
+            visitas[k] += 1
             if mdp.es_terminal(s_):
-                Q[(s, a)] += alfa * (r - Q[(s, a)])
+                Q.actualizar(i, k, valores[k] + alfa * (r - valores[k]))
                 break
-            a_ = politica_e_greedy(Q, s_, mdp.acciones_legales(s_), epsilon)
-            Q[(s, a)] += alfa * (r + mdp.gama * Q[(s_, a_)] - Q[(s, a)])
-            s, a = s_, a_       
+            i_ = indice[s_]
+            k_ = _e_greedy(Q, i_, epsilon, rng)
+            Q.actualizar(i, k, valores[k] + alfa * (
+                r + mdp.gama * valores[k_] - valores[k]))
+            s, i, k = s_, i_, k_
+        if metricas is not None:
+            metricas.registrar('SARSA', ep + 1, longitud=t, 
+                               retorno=retorno)
+        if punto_control is not None and punto_control.toca(ep + 1):
+            _guardar_control(punto_control, 'SARSA', Q, ep + 1, rng, mdp)
+        if monitor is not None and monitor.episodio(Q):
+            break
     return Q
 
-def Q_learning(mdp, epsilon, alfa, n_ep, n_iter):
+def Q_learning(mdp, epsilon, alfa, n_ep, n_iter, rng=None, Q0=None, 
+               monitor=None, metricas=None, punto_control=None):
     """
     Algoritmo Q-learning para estimar la función de valor de un MDP.
     
@@ -131,24 +704,826 @@ def Q_learning(mdp, epsilon, alfa, n_ep, n_iter):
         alfa: tasa de aprendizaje
         n_ep: número de episodios
         n_iter: número de iteraciones
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        Q0: QTabla desde la que se continúa el aprendizaje (se modifica)
+        monitor: MonitorConvergencia que puede terminar antes (opcional)
+        metricas: registro de métricas por episodio (ver metricas.py)
+        punto_control: PuntoControl en el que se guardan Q, el episodio y 
+            el estado de rng y mdp.rng; si ya existe se continúa desde él
+            (ver persistencia.py)
+    
+    Devuelve una QTabla, que se usa igual que el diccionario {(s, a): Q}.
     
     """
-    Q = {(s, a): 0 
-         for s in mdp.estados if not mdp.es_terminal(s)
-         for a in mdp.acciones_legales(s)}
+    if rng is None:
+        rng = FuenteAleatoria()
+    Q = QTabla(mdp) if Q0 is None else Q0
+    valores, visitas, indice, accion, mejor = (
+        Q.valores, Q.visitas, Q.indice, Q.accion_en, Q.mejor)
+    inicio = 0
+    if punto_control is not None and punto_control.existe():
+        inicio = _reanudar(punto_control, 'Q_learning', Q, rng, mdp)
+    
+    if metricas is not None:
+        metricas.iniciar()
     
-    for _ in range(n_ep):
+    for ep in range(inicio, n_ep):
         s = mdp.estado_inicial()
-        for _ in range(n_iter):
-            a = politica_e_greedy(Q, s, mdp.acciones_legales(s), epsilon)
+        i = indice[s]
+        retorno = 0
+        for t in range(1, n_iter + 1):
+            k = _e_greedy(Q, i, epsilon, rng)
+            a = accion[k]
             s_ = mdp.transicion(s, a)
             r = mdp.recompensa(s, a, s_)
+            retorno += r
+            visitas[k] += 1
             if mdp.es_terminal(s_):
-                Q[(s, a)] += alfa * (r - Q[(s, a)])
+                Q.actualizar(i, k, valores[k] + alfa * (r - valores[k]))
+                break
+            i_ = indice[s_]
+            Q.actualizar(i, k, valores[k] + alfa * (
+                r + mdp.gama * valores[mejor[i_]] - valores[k]))
+            s, i = s_, i_
+        if metricas is not None:
+            metricas.registrar('Q_learning', ep + 1, longitud=t, 
+                               retorno=retorno)
+        if punto_control is not None and punto_control.toca(ep + 1):
+            _guardar_control(punto_control, 'Q_learning', Q, ep + 1, rng, mdp)
+        if monitor is not None and monitor.episodio(Q):
+            break
+    return Q
+
+def _guardar_control(punto_control, algoritmo, Q, episodio, rng, mdp):
+    """
+    Guarda el punto de control de un algoritmo de aprendizaje al terminar 
+    el episodio dado (contando desde 1).
+    
+    """
+    metadatos = {'algoritmo': algoritmo, 'episodio': episodio, 
+                 'tam_bloque': rng.tam_bloque, 'rng': rng.estado()}
+    if isinstance(getattr(mdp, 'rng', None), FuenteAleatoria):
+        metadatos['rng_mdp'] = mdp.rng.estado()
+    punto_control.guardar({
+        'valores': Q.arreglo,
+        'visitas': np.frombuffer(Q.visitas, dtype=np.int64),
+        # La acción greedy se guarda tal cual porque con empates 
+        # recalcular_mejor podría elegir otra y cambiar la exploración
+        'mejor': np.array(Q.mejor, dtype=np.int64),
+    }, metadatos)
+
+def _reanudar(punto_control, algoritmo, Q, rng, mdp):
+    """
+    Carga en Q, rng y mdp.rng el punto de control y devuelve el número de 
+    episodios ya hechos.
+    
+    """
+    arreglos, metadatos = punto_control.cargar(algoritmo)
+    if len(arreglos['valores']) != len(Q.valores):
+        raise ValueError("El punto de control es de una tabla Q distinta")
+    if metadatos['tam_bloque'] != rng.tam_bloque:
+        raise ValueError("La fuente aleatoria tiene otro tamaño de bloque")
+    Q.arreglo[:] = arreglos['valores']
+    np.frombuffer(Q.visitas, dtype=np.int64)[:] = arreglos['visitas']
+    Q.mejor[:] = arreglos['mejor'].tolist()
+    rng.restaurar(metadatos['rng'])
+    if 'rng_mdp' in metadatos:
+        mdp.rng.restaurar(metadatos['rng_mdp'])
+    return metadatos['episodio']
+
+def SARSA_lambda(mdp, epsilon, alfa, lamda, n_ep, n_iter, umbral=1e-3, 
+                 rng=None, Q0=None, monitor=None, metricas=None):
+    """
+    Algoritmo SARSA(lambda) con trazas de elegibilidad dispersas.
+    
+    Cada error temporal se reparte entre los pares (s, a) visitados 
+    recientemente, con peso (gama * lamda)^t, así que la recompensa de 
+    llegar a la meta se propaga a muchos estados en un solo episodio. Las 
+    trazas son de reemplazo y se guardan en un diccionario posición -> 
+    traza que solo contiene las mayores que umbral, de modo que el costo 
+    por paso está acotado por log(umbral) / log(gama * lamda).
+    
+    Parámetros:
+        mdp: objeto de la clase MDPsim
+        epsilon: probabilidad de exploración
+        alfa: tasa de aprendizaje
+        lamda: parámetro lambda de las trazas, en [0, 1]
+        n_ep: número de episodios
+        n_iter: número de iteraciones
+        umbral: trazas menores se descartan
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        Q0: QTabla desde la que se continúa el aprendizaje (se modifica)
+        monitor: MonitorConvergencia que puede terminar antes (opcional)
+        metricas: registro de métricas por episodio (ver metricas.py)
+    
+    Devuelve una QTabla, igual que SARSA.
+    
+    """
+    return _aprendizaje_lambda(mdp, epsilon, alfa, lamda, n_ep, n_iter, 
+                               umbral, rng, Q0, monitor, metricas, 
+                               watkins=False)
+
+def Q_lambda(mdp, epsilon, alfa, lamda, n_ep, n_iter, umbral=1e-3, 
+             rng=None, Q0=None, monitor=None, metricas=None):
+    """
+    Algoritmo Q(lambda) de Watkins con trazas de elegibilidad dispersas.
+    
+    Igual que SARSA_lambda pero el objetivo usa la acción greedy, y las 
+    trazas se borran cada vez que se toma una acción exploratoria, porque 
+    a partir de ahí la trayectoria ya no sigue la política greedy.
+    
+    Parámetros:
+        mdp: objeto de la clase MDPsim
+        epsilon: probabilidad de exploración
+        alfa: tasa de aprendizaje
+        lamda: parámetro lambda de las trazas, en [0, 1]
+        n_ep: número de episodios
+        n_iter: número de iteraciones
+        umbral: trazas menores se descartan
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        Q0: QTabla desde la que se continúa el aprendizaje (se modifica)
+        monitor: MonitorConvergencia que puede terminar antes (opcional)
+        metricas: registro de métricas por episodio (ver metricas.py)
+    
+    Devuelve una QTabla, igual que Q_learning.
+    
+    """
+    return _aprendizaje_lambda(mdp, epsilon, alfa, lamda, n_ep, n_iter, 
+                               umbral, rng, Q0, monitor, metricas, 
+                               watkins=True)
+
+def _aprendizaje_lambda(mdp, epsilon, alfa, lamda, n_ep, n_iter, umbral, 
+                        rng, Q0, monitor, metricas, watkins):
+    """
+    Ciclo común de SARSA_lambda y Q_lambda.
+    
+    """
+    if rng is None:
+        rng = FuenteAleatoria()
+    Q = QTabla(mdp) if Q0 is None else Q0
+    valores, visitas, indice, accion, mejor = (
+        Q.valores, Q.visitas, Q.indice, Q.accion_en, Q.mejor)
+    fila_de = np.repeat(np.arange(len(Q.estados)), np.diff(Q.inicio)).tolist()
+    decaimiento = mdp.gama * lamda
+    nombre = 'Q_lambda' if watkins else 'SARSA_lambda'
+    
+    if metricas is not None:
+        metricas.iniciar()
+    
+    for ep in range(n_ep):
+        trazas = {}
+        s = mdp.estado_inicial()
+        i = indice[s]
+        k = _e_greedy(Q, i, epsilon, rng)
+        retorno = 0
+        for t in range(1, n_iter + 1):
+            a = accion[k]
+            s_ = mdp.transicion(s, a)
+            r = mdp.recompensa(s, a, s_)
+            retorno += r
+            visitas[k] += 1
+            terminal = mdp.es_terminal(s_)
+            if terminal:
+                delta = r - valores[k]
+            else:
+                i_ = indice[s_]
+                k_ = _e_greedy(Q, i_, epsilon, rng)
+                m = mejor[i_]
+                delta = r + mdp.gama * valores[m if watkins else k_] - valores[k]
+                exploratoria = valores[k_] < valores[m]
+            
+            trazas[k] = 1.0
+            for kk, e in list(trazas.items()):
+                Q.actualizar(fila_de[kk], kk, valores[kk] + alfa * delta * e)
+                e *= decaimiento
+                if e < umbral:
+                    del trazas[kk]
+                else:
+                    trazas[kk] = e
+            
+            if terminal:
+                break
+            if watkins and exploratoria:
+                trazas.clear()
+            s, i, k = s_, i_, k_
+        if metricas is not None:
+            metricas.registrar(nombre, ep + 1, longitud=t, retorno=retorno)
+        if monitor is not None and monitor.episodio(Q):
+            break
+    return Q
+
+def Dyna_Q(mdp, epsilon, alfa, n_ep, n_iter, n_plan=10, rng=None, Q0=None,
+           monitor=None, metricas=None):
+    """
+    Algoritmo Dyna-Q: Q-learning con un modelo aprendido de las transiciones.
+    
+    Para cada par (s, a) visitado se guarda la última recompensa y el último
+    estado siguiente observados. Después de cada paso real se hacen n_plan 
+    actualizaciones simuladas sobre pares visitados elegidos al azar, sin 
+    llamar a mdp.transicion. El modelo es el de la última observación, así
+    que en MDPs estocásticos cada actualización simulada usa una muestra 
+    reciente en lugar del valor esperado.
+    
+    Parámetros:
+        mdp: objeto de la clase MDPsim
+        epsilon: probabilidad de exploración
+        alfa: tasa de aprendizaje
+        n_ep: número de episodios
+        n_iter: número de iteraciones
+        n_plan: actualizaciones simuladas por paso real
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        Q0: QTabla desde la que se continúa el aprendizaje (se modifica)
+        monitor: MonitorConvergencia que puede terminar antes (opcional)
+        metricas: registro de métricas por episodio (ver metricas.py)
+    
+    Devuelve una QTabla, igual que Q_learning.
+    
+    """
+    Q = QTabla(mdp) if Q0 is None else Q0
+    return _q_planificado(mdp, epsilon, alfa, n_ep, n_iter, n_plan, rng, Q,
+                          _Modelo(len(Q.valores)), monitor, metricas,
+                          'Dyna_Q')
+
+def Q_learning_repeticion(mdp, epsilon, alfa, n_ep, n_iter, n_plan=10, 
+                          capacidad=100_000, rng=None, Q0=None, 
+                          monitor=None, metricas=None):
+    """
+    Algoritmo Q-learning con memoria de repetición de experiencias.
+    
+    Las últimas capacidad transiciones observadas se guardan en un búfer 
+    circular. Después de cada paso real se repiten n_plan transiciones 
+    elegidas al azar del búfer, todas en una sola actualización vectorizada.
+    A diferencia de Dyna_Q, el búfer conserva varias muestras de cada par
+    (s, a), así que respeta la distribución de las transiciones 
+    estocásticas.
+    
+    Parámetros:
+        mdp: objeto de la clase MDPsim
+        epsilon: probabilidad de exploración
+        alfa: tasa de aprendizaje
+        n_ep: número de episodios
+        n_iter: número de iteraciones
+        n_plan: transiciones repetidas por paso real
+        capacidad: número máximo de transiciones en la memoria
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        Q0: QTabla desde la que se continúa el aprendizaje (se modifica)
+        monitor: MonitorConvergencia que puede terminar antes (opcional)
+        metricas: registro de métricas por episodio (ver metricas.py)
+    
+    Devuelve una QTabla, igual que Q_learning.
+    
+    """
+    Q = QTabla(mdp) if Q0 is None else Q0
+    return _q_planificado(mdp, epsilon, alfa, n_ep, n_iter, n_plan, rng, Q,
+                          _Memoria(capacidad), monitor, metricas,
+                          'Q_learning_repeticion')
+
+class _Modelo:
+    """
+    Modelo de Dyna-Q: última recompensa y último renglón siguiente (-1 si 
+    es terminal) de cada posición de la tabla Q, y la lista de posiciones 
+    visitadas.
+    
+    """
+    def __init__(self, n):
+        self.r = np.zeros(n)
+        self.i_ = np.full(n, -1, dtype=np.int64)
+        self.visto = np.zeros(n, dtype=bool)
+        self.vistos = np.empty(n, dtype=np.int64)
+        self.n = 0
+    
+    def guardar(self, k, r, i_):
+        self.r[k], self.i_[k] = r, i_
+        if not self.visto[k]:
+            self.visto[k] = True
+            self.vistos[self.n] = k
+            self.n += 1
+    
+    def muestra(self, m, rng):
+        K = self.vistos[rng.randint_lote(0, self.n - 1, m)]
+        return K, self.r[K], self.i_[K]
+
+class _Memoria:
+    """
+    Búfer circular de transiciones (posición, recompensa, renglón siguiente).
+    
+    """
+    def __init__(self, capacidad):
+        self.k = np.empty(capacidad, dtype=np.int64)
+        self.r = np.empty(capacidad)
+        self.i_ = np.empty(capacidad, dtype=np.int64)
+        self.capacidad, self.n, self.siguiente = capacidad, 0, 0
+    
+    def guardar(self, k, r, i_):
+        j = self.siguiente
+        self.k[j], self.r[j], self.i_[j] = k, r, i_
+        self.siguiente = (j + 1) % self.capacidad
+        self.n = min(self.n + 1, self.capacidad)
+    
+    def muestra(self, m, rng):
+        J = rng.randint_lote(0, self.n - 1, m)
+        return self.k[J], self.r[J], self.i_[J]
+
+def _q_planificado(mdp, epsilon, alfa, n_ep, n_iter, n_plan, rng, Q, memoria,
+                   monitor, metricas, nombre):
+    """
+    Ciclo común de Dyna_Q y Q_learning_repeticion: un paso real de 
+    Q-learning que se guarda en memoria, seguido de n_plan actualizaciones 
+    con transiciones tomadas de ella.
+    
+    """
+    if rng is None:
+        rng = FuenteAleatoria()
+    valores, visitas, indice, accion, mejor = (
+        Q.valores, Q.visitas, Q.indice, Q.accion_en, Q.mejor)
+    fila_de = np.repeat(np.arange(len(Q.estados)), np.diff(Q.inicio)).tolist()
+    
+    if metricas is not None:
+        metricas.iniciar()
+    
+    for ep in range(n_ep):
+        s = mdp.estado_inicial()
+        i = indice[s]
+        retorno = 0
+        for t in range(1, n_iter + 1):
+            k = _e_greedy(Q, i, epsilon, rng)
+            a = accion[k]
+            s_ = mdp.transicion(s, a)
+            r = mdp.recompensa(s, a, s_)
+            retorno += r
+            visitas[k] += 1
+            terminal = mdp.es_terminal(s_)
+            i_ = -1 if terminal else indice[s_]
+            objetivo = r if terminal else r + mdp.gama * valores[mejor[i_]]
+            Q.actualizar(i, k, valores[k] + alfa * (objetivo - valores[k]))
+            memoria.guardar(k, r, i_)
+            if n_plan:
+                _repasar(Q, fila_de, *memoria.muestra(n_plan, rng), alfa, 
+                         mdp.gama)
+            if terminal:
                 break
-            Q[(s, a)] += alfa * (
-                r 
-                + mdp.gama * max(Q[(s_, a_)] for a_ in mdp.acciones_legales(s_)) 
-                - Q[(s, a)])
-            s = s_
-    return Q
\ No newline at end of file
+            s, i = s_, i_
+        if metricas is not None:
+            metricas.registrar(nombre, ep + 1, longitud=t, retorno=retorno)
+        if monitor is not None and monitor.episodio(Q):
+            break
+    return Q
+
+def _repasar(Q, fila_de, K, R, I_, alfa, gama):
+    """
+    Aplica a Q la actualización de Q-learning de un lote de transiciones. 
+    Los objetivos se calculan todos con la tabla anterior al lote y las 
+    actualizaciones repetidas de un mismo par se promedian.
+    
+    """
+    valores, mejor = Q.valores, Q.mejor
+    siguiente = Q.arreglo[[mejor[i_] for i_ in I_.tolist()]]
+    objetivo = R + gama * np.where(I_ >= 0, siguiente, 0.0)
+    pares, inverso = np.unique(K, return_inverse=True)
+    error = (np.bincount(inverso, weights=objetivo - Q.arreglo[K]) 
+             / np.bincount(inverso))
+    for k, e in zip(pares.tolist(), error.tolist()):
+        Q.actualizar(fila_de[k], k, valores[k] + alfa * e)
+
+def SARSA_lote(mdp, epsilon, alfa, n_ep, n_iter, n_amb=64, rng=None, 
+               metricas=None):
+    """
+    Algoritmo SARSA con n_amb episodios simulados a la vez.
+    
+    Usa la interfaz *_lote del simulador y una QTabla densa, y aplica en un
+    solo paso las actualizaciones de todos los ambientes. 
+    Cuando un episodio termina su ambiente empieza uno nuevo hasta 
+    completar n_ep episodios.
+    
+    Parámetros:
+        mdp: objeto de la clase MDPsim
+        epsilon: probabilidad de exploración
+        alfa: tasa de aprendizaje
+        n_ep: número de episodios
+        n_iter: número de iteraciones
+        n_amb: número de episodios que se simulan en paralelo
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        metricas: registro de métricas por episodio (ver metricas.py); 
+            el tiempo de cada episodio es el transcurrido desde el último 
+            episodio que terminó en cualquier ambiente
+    
+    """
+    return _aprendizaje_lote(mdp, epsilon, alfa, n_ep, n_iter, n_amb, rng,
+                             metricas, sarsa=True)
+
+def Q_learning_lote(mdp, epsilon, alfa, n_ep, n_iter, n_amb=64, rng=None,
+                    metricas=None):
+    """
+    Algoritmo Q-learning con n_amb episodios simulados a la vez 
+    (ver SARSA_lote).
+    
+    Parámetros:
+        mdp: objeto de la clase MDPsim
+        epsilon: probabilidad de exploración
+        alfa: tasa de aprendizaje
+        n_ep: número de episodios
+        n_iter: número de iteraciones
+        n_amb: número de episodios que se simulan en paralelo
+        rng: FuenteAleatoria para la exploración (nueva si es None)
+        metricas: registro de métricas por episodio (ver metricas.py); 
+            el tiempo de cada episodio es el transcurrido desde el último 
+            episodio que terminó en cualquier ambiente
+    
+    """
+    return _aprendizaje_lote(mdp, epsilon, alfa, n_ep, n_iter, n_amb, rng,
+                             metricas, sarsa=False)
+
+def _aprendizaje_lote(mdp, epsilon, alfa, n_ep, n_iter, n_amb, rng, metricas,
+                      sarsa):
+    """
+    Ciclo común de SARSA_lote y Q_learning_lote.
+    
+    """
+    if rng is None:
+        rng = FuenteAleatoria()
+    Q = QTabla(mdp, inicial=rng.random if sarsa else 0.0, denso=True)
+    indice = _indexador(Q.estados)
+    lista_estados = _arreglo(Q.estados)
+    lista_acciones = _arreglo(Q.acciones)
+    n_acciones = len(Q.acciones)
+    M = Q.arreglo.reshape(len(Q.estados), n_acciones)
+    mascara = Q.legal.reshape(M.shape)
+    visitas = np.frombuffer(Q.visitas, dtype=np.int64)
+    # Columnas legales de cada estado al inicio de su renglón, para que 
+    # explorar sea elegir una posición al azar entre las n_legales primeras
+    n_legales = mascara.sum(axis=1)
+    posiciones = np.argsort(~mascara, axis=1, kind='stable')
+    posiciones = posiciones[:, :max(1, n_legales.max())]
+    
+    def e_greedy(I, voraz=None):
+        A = M[I].argmax(axis=1) if voraz is None else voraz.copy()
+        explora = np.flatnonzero(rng.random_lote(len(I)) < epsilon)
+        if len(explora):
+            J = I[explora]
+            k = (rng.random_lote(len(explora)) * n_legales[J]).astype(np.int64)
+            A[explora] = posiciones[J, k]
+        return A
+    
+    n = min(n_amb, n_ep)
+    iniciados = n
+    I = indice(mdp.estado_inicial_lote(n))
+    A = e_greedy(I)
+    pasos = np.zeros(n, dtype=np.int64)
+    retorno = np.zeros(n)
+    nombre, terminados = 'SARSA_lote' if sarsa else 'Q_learning_lote', 0
+    if metricas is not None:
+        metricas.iniciar()
+    
+    while len(I):
+        S_ = mdp.transicion_lote(lista_estados[I], lista_acciones[A])
+        r = mdp.recompensa_lote(lista_estados[I], lista_acciones[A], S_)
+        terminal = mdp.es_terminal_lote(S_)
+        I_ = indice(S_)
+        
+        voraz = M[I_].argmax(axis=1)
+        A_ = e_greedy(I_, voraz)
+        siguiente = M[I_, A_] if sarsa else M[I_, voraz]
+        objetivo = r + mdp.gama * np.where(terminal, 0, siguiente)
+        # Si varios ambientes actualizan el mismo par (s, a) se promedian sus
+        # errores, para que el paso sea alfa y no alfa por el número de copias
+        pares, inverso = np.unique(I * n_acciones + A, return_inverse=True)
+        error = np.bincount(inverso, weights=objetivo - M[I, A])
+        cuenta = np.bincount(inverso)
+        Q.arreglo[pares] += alfa * error / cuenta
+        visitas[pares] += cuenta
+        
+        I, A = I_, A_
+        pasos += 1
+        retorno += r
+        fin = np.flatnonzero(terminal | (pasos >= n_iter))
+        if len(fin) and metricas is not None:
+            for longitud, G in zip(pasos[fin].tolist(), retorno[fin].tolist()):
+                terminados += 1
+                metricas.registrar(nombre, terminados, longitud=longitud, 
+                                   retorno=G)
+        if len(fin):
+            nuevos = min(len(fin), n_ep - iniciados)
+            reinicio, baja = fin[:nuevos], fin[nuevos:]
+            I[reinicio] = indice(mdp.estado_inicial_lote(nuevos))
+            A[reinicio] = e_greedy(I[reinicio])
+            pasos[reinicio] = 0
+            retorno[reinicio] = 0
+            iniciados += nuevos
+            if len(baja):
+                sigue = np.ones(len(I), dtype=bool)
+                sigue[baja] = False
+                I, A, pasos = I[sigue], A[sigue], pasos[sigue]
+                retorno = retorno[sigue]
+    
+    Q.recalcular_mejor()
+    return Q
+
+def _arreglo(valores):
+    """
+    Convierte una lista de estados o acciones en un arreglo de NumPy de una
+    dimensión, sin desarmar los estados que son tuplas.
+    
+    """
+    arreglo = np.array(valores)
+    if arreglo.ndim > 1:
+        arreglo = np.fromiter(valores, dtype=object, count=len(valores))
+    return arreglo
+
+def _indexador(estados):
+    """
+    Devuelve una función que convierte un arreglo de estados en el arreglo
+    de sus índices en estados.
+    
+    """
+    arreglo = np.array(estados)
+    if arreglo.ndim == 1 and np.issubdtype(arreglo.dtype, np.number):
+        orden = np.argsort(arreglo, kind='stable')
+        ordenados = arreglo[orden]
+        return lambda S: orden[np.searchsorted(ordenados, S)]
+    
+    indice = {s: i for i, s in enumerate(estados)}
+    return lambda S: np.array([indice[s] for s in S.tolist()], dtype=np.int64)
+
+def aprendizaje_paralelo(algoritmo, mdp, n_ep, procesos=4, rondas=1, 
+                         combinar='visitas', semilla=None, **opciones):
+    """
+    Entrena varios aprendices independientes en procesos separados y combina
+    sus tablas Q.
+    
+    Cada ronda reparte los n_ep episodios entre los procesos. Cada proceso 
+    parte de la tabla combinada de la ronda anterior y usa sus propias 
+    fuentes aleatorias para explorar y para el simulador, derivadas de 
+    semilla, así que el resultado es reproducible. Al final de la ronda las 
+    tablas se combinan en una sola.
+    
+    Parámetros:
+        algoritmo: SARSA o Q_learning (cualquier función que acepte rng y Q0)
+        mdp: objeto de la clase MDPsim, que debe poder serializarse
+        n_ep: número total de episodios
+        procesos: número de aprendices en paralelo
+        rondas: número de veces que se combinan las tablas
+        combinar: 'promedio' para el promedio simple de los valores o 
+            'visitas' para ponderar cada entrada por sus actualizaciones
+        semilla: semilla de la que se derivan todas las fuentes aleatorias
+        **opciones: argumentos de algoritmo (epsilon, alfa, n_iter, ...)
+    
+    Devuelve una QTabla, igual que algoritmo.
+    
+    """
+    if combinar not in ('promedio', 'visitas'):
+        raise ValueError(f"Forma de combinar desconocida: {combinar}")
+    
+    fuente = FuenteAleatoria(semilla)
+    Q = None
+    with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+        for ronda in range(rondas):
+            n_ronda = n_ep // rondas + (ronda < n_ep % rondas)
+            fuentes = fuente.engendrar(2 * procesos)
+            tablas = list(ejecutor.map(
+                _aprender, 
+                [algoritmo] * procesos, [mdp] * procesos, [Q] * procesos,
+                [n_ronda // procesos + (p < n_ronda % procesos) 
+                 for p in range(procesos)],
+                fuentes[:procesos], fuentes[procesos:], [opciones] * procesos
+            ))
+            Q = combinar_tablas(tablas, combinar, base=Q)
+    return Q
+
+def _aprender(algoritmo, mdp, Q, n_ep, rng, rng_mdp, opciones):
+    """
+    Tarea de cada proceso en aprendizaje_paralelo.
+    
+    """
+    mdp.rng = rng_mdp
+    return algoritmo(mdp, n_ep=n_ep, rng=rng, Q0=Q, **opciones)
+
+def combinar_tablas(tablas, combinar='visitas', base=None):
+    """
+    Combina varias QTablas del mismo MDP en una nueva.
+    
+    Parámetros:
+        tablas: lista de QTablas con la misma estructura
+        combinar: 'promedio' o 'visitas' (ver aprendizaje_paralelo); si una
+            entrada no tiene visitas en ninguna tabla se usa el promedio
+        base: QTabla de la que partieron todas las tablas, si la hay; sus 
+            visitas se descuentan para ponderar solo lo aprendido después
+    
+    """
+    Q = deepcopy(tablas[0])
+    legal = Q.legal
+    valores = np.stack([tabla.arreglo[legal] for tabla in tablas])
+    visitas = np.stack([
+        np.frombuffer(tabla.visitas, dtype=np.int64)[legal] for tabla in tablas
+    ])
+    previas = (0 if base is None else 
+               np.frombuffer(base.visitas, dtype=np.int64)[legal])
+    visitas = visitas - previas
+    
+    if combinar == 'visitas':
+        total = visitas.sum(axis=0)
+        ponderado = (valores * visitas).sum(axis=0) / np.maximum(total, 1)
+        Q.arreglo[legal] = np.where(total > 0, ponderado, valores.mean(axis=0))
+    else:
+        Q.arreglo[legal] = valores.mean(axis=0)
+    np.frombuffer(Q.visitas, dtype=np.int64)[legal] = previas + visitas.sum(axis=0)
+    Q.recalcular_mejor()
+    return Q
+
+def Q_learning_actores(mdp, epsilon, alfa, n_ep, n_iter, actores=2, 
+                       tam_lote=256, n_ranuras=16, semilla=None, 
+                       metricas=None):
+    """
+    Q-learning con varios procesos simuladores (actores) y un aprendiz.
+    
+    Los actores simulan episodios con la política epsilon-greedy de la 
+    tabla Q compartida y escriben sus transiciones en un búfer circular en 
+    memoria compartida, dividido en n_ranuras ranuras de tam_lote 
+    transiciones. El aprendiz, en el proceso principal, toma cada ranura 
+    llena, aplica la actualización de Q-learning de todo el lote con 
+    operaciones vectorizadas y escribe el resultado en la misma tabla 
+    compartida, que los actores leen sin bloquearla. Así la simulación y el
+    aprendizaje se traslapan.
+    
+    Por las colas solo viajan números de ranura; los datos se quedan en la 
+    memoria compartida.
+    
+    Parámetros:
+        mdp: objeto de la clase MDPsim, que debe poder serializarse
+        epsilon: probabilidad de exploración
+        alfa: tasa de aprendizaje
+        n_ep: número de episodios
+        n_iter: número de iteraciones
+        actores: número de procesos simuladores
+        tam_lote: transiciones por ranura del búfer
+        n_ranuras: número de ranuras del búfer
+        semilla: semilla de la que se derivan las fuentes de los actores
+        metricas: objeto Metricas (opcional) que recibe la longitud y el 
+            retorno de cada episodio; el aprendiz los reconstruye de los 
+            lotes, que de cada actor llegan en orden
+    
+    Devuelve una QTabla, igual que Q_learning.
+    
+    """
+    contexto = mp.get_context()
+    Q = QTabla(mdp)
+    
+    compartida = contexto.RawArray('d', len(Q.columna))
+    valores = np.frombuffer(compartida)
+    valores[:] = Q.arreglo
+    bufer = {
+        'k': contexto.RawArray('q', n_ranuras * tam_lote),
+        'r': contexto.RawArray('d', n_ranuras * tam_lote),
+        'i_': contexto.RawArray('q', n_ranuras * tam_lote),
+        'fin': contexto.RawArray('b', n_ranuras * tam_lote),
+    }
+    libres, llenas, errores = (contexto.Queue() for _ in range(3))
+    for ranura in range(n_ranuras):
+        libres.put(ranura)
+    parar = contexto.Event()
+    
+    fuentes = FuenteAleatoria(semilla).engendrar(2 * actores)
+    procesos = [
+        contexto.Process(target=_actor, args=(
+            mdp, Q, compartida, bufer, tam_lote, libres, llenas, errores, 
+            parar, epsilon, n_iter, j, fuentes[2 * j], fuentes[2 * j + 1]
+        ), daemon=True)
+        for j in range(actores)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    
+    k_lote, r_lote, i_lote, fin_lote = (
+        np.frombuffer(bufer[nombre], dtype=dtype).reshape(n_ranuras, tam_lote)
+        for nombre, dtype in [('k', np.int64), ('r', np.float64), 
+                              ('i_', np.int64), ('fin', np.int8)]
+    )
+    visitas = np.frombuffer(Q.visitas, dtype=np.int64)
+    fila_de = np.repeat(np.arange(len(Q.estados)), np.diff(Q.inicio))
+    mejor = np.array(Q.mejor, dtype=np.int64)
+    # Pasos y recompensa acumulados del episodio en curso de cada actor
+    longitud, retorno = [0] * actores, [0.0] * actores
+    if metricas is not None:
+        metricas.iniciar()
+    
+    episodios = 0
+    try:
+        while episodios < n_ep:
+            try:
+                ranura, n, j = llenas.get(timeout=0.5)
+            except queue.Empty:
+                _revisar_actores(procesos, errores)
+                continue
+            k, r, i_ = k_lote[ranura, :n], r_lote[ranura, :n], i_lote[ranura, :n]
+            if metricas is not None:
+                desde = 0
+                for hasta in (np.flatnonzero(fin_lote[ranura, :n]) + 1).tolist():
+                    episodios += 1
+                    metricas.registrar(
+                        'Q_learning_actores', episodios, 
+                        longitud=longitud[j] + hasta - desde, 
+                        retorno=retorno[j] + float(r[desde:hasta].sum()))
+                    longitud[j], retorno[j], desde = 0, 0.0, hasta
+                longitud[j] += n - desde
+                retorno[j] += float(r[desde:].sum())
+            else:
+                episodios += int(fin_lote[ranura, :n].sum())
+            
+            siguiente = np.where(i_ >= 0, valores[mejor[np.maximum(i_, 0)]], 0)
+            objetivo = r + mdp.gama * siguiente
+            pares, inverso = np.unique(k, return_inverse=True)
+            error = np.bincount(inverso, weights=objetivo - valores[k])
+            cuenta = np.bincount(inverso)
+            valores[pares] += alfa * error / cuenta
+            visitas[pares] += cuenta
+            libres.put(ranura)
+            
+            for i in np.unique(fila_de[pares]).tolist():
+                inicio, fin = Q._inicio[i], Q._inicio[i + 1]
+                mejor[i] = inicio + int(np.argmax(valores[inicio:fin]))
+    finally:
+        parar.set()
+        while any(proceso.is_alive() for proceso in procesos):
+            try:
+                llenas.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for proceso in procesos:
+            proceso.join()
+    
+    Q.arreglo[:] = valores
+    Q.recalcular_mejor()
+    return Q
+
+def _revisar_actores(procesos, errores):
+    """
+    Lanza RuntimeError, con el error del actor si lo envió, cuando alguno
+    de los actores de Q_learning_actores terminó antes de tiempo.
+    
+    """
+    for j, proceso in enumerate(procesos):
+        if proceso.exitcode is not None:
+            try:
+                detalle = errores.get(timeout=1)
+            except queue.Empty:
+                detalle = f"código de salida {proceso.exitcode}"
+            raise RuntimeError(
+                f"El actor {j} terminó antes de tiempo:\n{detalle}")
+
+def _actor(mdp, Q, compartida, bufer, tam_lote, libres, llenas, errores, 
+           parar, epsilon, n_iter, numero, rng, rng_mdp):
+    """
+    Proceso simulador de Q_learning_actores. Si falla, manda el error por
+    la cola errores antes de terminar.
+    
+    """
+    try:
+        _simular(mdp, Q, compartida, bufer, tam_lote, libres, llenas, parar, 
+                 epsilon, n_iter, numero, rng, rng_mdp)
+    except BaseException:
+        errores.put(traceback.format_exc())
+        raise
+
+def _simular(mdp, Q, compartida, bufer, tam_lote, libres, llenas, parar, 
+             epsilon, n_iter, numero, rng, rng_mdp):
+    """
+    Ciclo de simulación de cada actor (ver _actor). Cada ranura llena se 
+    anuncia con el número del actor, para que el aprendiz pueda seguir sus 
+    episodios de un lote al siguiente.
+    
+    """
+    mdp.rng = rng_mdp
+    valores = np.frombuffer(compartida)
+    k_lote, r_lote, i_lote, fin_lote = (
+        np.frombuffer(bufer[nombre], dtype=dtype).reshape(-1, tam_lote)
+        for nombre, dtype in [('k', np.int64), ('r', np.float64), 
+                              ('i_', np.int64), ('fin', np.int8)]
+    )
+    indice, legales, accion, inicio = Q.indice, Q.legales, Q.accion_en, Q._inicio
+    
+    s, pasos = mdp.estado_inicial(), 0
+    while not parar.is_set():
+        try:
+            ranura = libres.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        
+        for j in range(tam_lote):
+            i = indice[s]
+            if rng.random() < epsilon:
+                k = rng.choice(legales[i])
+            else:
+                k = inicio[i] + int(np.argmax(valores[inicio[i]:inicio[i + 1]]))
+            a = accion[k]
+            s_ = mdp.transicion(s, a)
+            pasos += 1
+            terminal = mdp.es_terminal(s_)
+            
+            k_lote[ranura, j] = k
+            r_lote[ranura, j] = mdp.recompensa(s, a, s_)
+            i_lote[ranura, j] = -1 if terminal else indice[s_]
+            fin_lote[ranura, j] = terminal or pasos >= n_iter
+            if fin_lote[ranura, j]:
+                s, pasos = mdp.estado_inicial(), 0
+            else:
+                s = s_
+        llenas.put((ranura, tam_lote, numero))
@@ -0,0 +1,248 @@
+"""
+Pruebas de desempeño de los algoritmos de programación dinámica y de
+aprendizaje por refuerzo sobre los problemas de ejemplo, a tamaños
+crecientes.
+
+Cada corrida (problema, algoritmo, tamaño) se hace en un proceso nuevo, lo
+que aísla el tiempo y permite medir la memoria máxima y cortar las que
+exceden el límite de tiempo. Los resultados se escriben en JSON y se pueden
+comparar contra un archivo base para detectar regresiones:
+
+    python benchmark.py --tamanos 100 1000 --salida base.json
+    python benchmark.py --tamanos 100 1000 --base base.json
+
+El tamaño es la meta de cada problema. Para cada corrida se registra:
+    tiempo: segundos de pared del algoritmo, sin construir el MDP
+    iteraciones: iteraciones (programación dinámica) o episodios
+    trabajo: respaldos de Bellman o pasos del simulador
+    trabajo_por_segundo: trabajo / tiempo
+    memoria_mb: memoria residente máxima del proceso
+    estado: 'ok', 'tiempo_agotado' o el error
+
+"""
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import random
+import resource
+import sys
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+
+import MDPs
+import RL
+from camion_magico import CamionMagicoProb
+from camnion_magico_rl import CamionMagico
+from gambler import Gambler
+from gambler_rl import Jugador
+from metricas import Metricas
+
+PROBLEMAS = {
+    'gambler': ('dp', lambda meta: Gambler(gama=1, meta=meta, ph=0.4)),
+    'camion_magico': ('dp', lambda meta: CamionMagicoProb(0.9, 0.9, meta)),
+    'jugador': ('rl', lambda meta: Jugador(meta, 0.4, 1)),
+    'camion_magico_rl': ('rl', lambda meta: CamionMagico(0.999, 0.9, meta)),
+}
+
+def _politica_fija(mdp):
+    """
+    Primera acción legal de cada estado no terminal, para evaluar políticas.
+    
+    """
+    return {s: next(iter(mdp.acciones_legales(s)))
+            for s in mdp.estados if not mdp.es_terminal(s)}
+
+ALGORITMOS = {
+    'dp': {
+        'iteracion_valor': lambda mdp, metricas, op: MDPs.iteracion_valor(
+            mdp, epsilon=op.epsilon, max_iter=op.max_iter, metricas=metricas),
+        'iteracion_valor_numpy': lambda mdp, metricas, op: MDPs.iteracion_valor(
+            mdp, epsilon=op.epsilon, max_iter=op.max_iter, motor='numpy',
+            metricas=metricas),
+        'iteracion_politica': lambda mdp, metricas, op: MDPs.iteracion_politica(
+            mdp, epsilon=op.epsilon, max_iter=op.max_iter, metricas=metricas),
+        'valor_politica': lambda mdp, metricas, op: MDPs.valor_politica(
+            _politica_fija(mdp), mdp, epsilon=op.epsilon, max_iter=op.max_iter,
+            metricas=metricas),
+    },
+    'rl': {
+        'TD0': lambda mdp, metricas, op: RL.TD0(
+            mdp, _politica_fija(mdp), op.alfa, op.n_ep, op.n_iter,
+            metricas=metricas),
+        'SARSA': lambda mdp, metricas, op: RL.SARSA(
+            mdp, op.epsilon_rl, op.alfa, op.n_ep, op.n_iter,
+            rng=RL.FuenteAleatoria(op.semilla), metricas=metricas),
+        'Q_learning': lambda mdp, metricas, op: RL.Q_learning(
+            mdp, op.epsilon_rl, op.alfa, op.n_ep, op.n_iter,
+            rng=RL.FuenteAleatoria(op.semilla), metricas=metricas),
+    },
+}
+
+def medir(problema, algoritmo, tamano, opciones):
+    """
+    Corre un caso en el proceso actual y devuelve su diccionario de
+    resultados. Con varias repeticiones se reporta el menor tiempo.
+    
+    """
+    tipo, fabrica = PROBLEMAS[problema]
+    tiempo = None
+    for _ in range(opciones.repeticiones):
+        random.seed(opciones.semilla)
+        mdp = fabrica(tamano)
+        if tipo == 'rl':
+            mdp.rng = RL.FuenteAleatoria(opciones.semilla + 1)
+        
+        metricas = Metricas()
+        inicio = perf_counter()
+        ALGORITMOS[tipo][algoritmo](mdp, metricas, opciones)
+        transcurrido = perf_counter() - inicio
+        tiempo = transcurrido if tiempo is None else min(tiempo, transcurrido)
+    
+    # Iteración de política también registra los barridos de sus 
+    # evaluaciones; las iteraciones son solo los registros del algoritmo
+    # principal, que siempre es el último
+    registros = metricas.registros
+    principal = registros[-1]['algoritmo'] if registros else None
+    campo = 'respaldos' if tipo == 'dp' else 'longitud'
+    trabajo = sum(registro[campo] for registro in registros)
+    return {
+        'tiempo': tiempo,
+        'iteraciones': sum(r['algoritmo'] == principal for r in registros),
+        'trabajo': trabajo,
+        'trabajo_por_segundo': trabajo / tiempo if tiempo > 0 else None,
+        'memoria_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'estado': 'ok',
+    }
+
+def _medir_en_proceso(problema, algoritmo, tamano, opciones, conexion):
+    try:
+        conexion.send(medir(problema, algoritmo, tamano, opciones))
+    except Exception as error:
+        conexion.send({'estado': f"{type(error).__name__}: {error}"})
+    finally:
+        conexion.close()
+
+def correr(problemas, algoritmos, tamanos, opciones):
+    """
+    Corre todos los casos, cada uno en un proceso nuevo, y devuelve la
+    lista de resultados. Los algoritmos que no aplican al tipo de problema
+    se omiten.
+    
+    """
+    contexto = mp.get_context('spawn')
+    resultados = []
+    for problema in problemas:
+        tipo = PROBLEMAS[problema][0]
+        for algoritmo in algoritmos:
+            if algoritmo not in ALGORITMOS[tipo]:
+                continue
+            for tamano in tamanos:
+                recibe, envia = contexto.Pipe(duplex=False)
+                proceso = contexto.Process(
+                    target=_medir_en_proceso,
+                    args=(problema, algoritmo, tamano, opciones, envia)
+                )
+                proceso.start()
+                envia.close()
+                if recibe.poll(opciones.limite):
+                    resultado = recibe.recv()
+                else:
+                    proceso.terminate()
+                    resultado = {'estado': 'tiempo_agotado'}
+                proceso.join()
+                
+                resultado = {'problema': problema, 'algoritmo': algoritmo,
+                             'tamano': tamano, **resultado}
+                resultados.append(resultado)
+                _imprimir(resultado)
+    return resultados
+
+def comparar(resultados, base, tolerancia):
+    """
+    Compara el tiempo de cada caso contra el mismo caso en base. Devuelve
+    la lista de regresiones (caso, tiempo base, tiempo nuevo): los casos
+    más lentos que (1 + tolerancia) veces la base, o que dejaron de
+    terminar bien.
+    
+    """
+    def clave(r):
+        return r['problema'], r['algoritmo'], r['tamano']
+    
+    anteriores = {clave(r): r for r in base['resultados']}
+    regresiones = []
+    for r in resultados:
+        anterior = anteriores.get(clave(r))
+        if anterior is None or anterior['estado'] != 'ok':
+            continue
+        if r['estado'] != 'ok' or r['tiempo'] > (1 + tolerancia) * anterior['tiempo']:
+            regresiones.append((clave(r), anterior['tiempo'], r.get('tiempo')))
+    return regresiones
+
+def _imprimir(r):
+    if r['estado'] == 'ok':
+        print(f"{r['problema']:>18} {r['algoritmo']:>22} {r['tamano']:>8} "
+              f"{r['tiempo']:10.3f} s {r['iteraciones']:>8} it "
+              f"{r['trabajo_por_segundo'] or 0:12.0f} /s "
+              f"{r['memoria_mb']:8.1f} MB")
+    else:
+        print(f"{r['problema']:>18} {r['algoritmo']:>22} {r['tamano']:>8} "
+              f"{r['estado']}")
+
+def _argumentos(argv=None):
+    todos = sorted({a for algoritmos in ALGORITMOS.values() for a in algoritmos})
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--problemas', nargs='+', choices=list(PROBLEMAS),
+                        default=list(PROBLEMAS))
+    parser.add_argument('--algoritmos', nargs='+', choices=todos, default=todos)
+    parser.add_argument('--tamanos', nargs='+', type=int, default=[100, 1000])
+    parser.add_argument('--salida', help="archivo JSON de resultados")
+    parser.add_argument('--base', help="archivo JSON contra el que se compara")
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help="aumento relativo de tiempo permitido")
+    parser.add_argument('--limite', type=float, default=600,
+                        help="segundos máximos por caso")
+    parser.add_argument('--epsilon', type=float, default=1e-6)
+    parser.add_argument('--max-iter', type=int, default=10_000)
+    parser.add_argument('--n-ep', type=int, default=1000)
+    parser.add_argument('--n-iter', type=int, default=1000)
+    parser.add_argument('--alfa', type=float, default=0.1)
+    parser.add_argument('--epsilon-rl', type=float, default=0.05)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--repeticiones', type=int, default=1,
+                        help="corridas por caso; se toma el menor tiempo")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    opciones = _argumentos(argv)
+    resultados = correr(opciones.problemas, opciones.algoritmos,
+                        opciones.tamanos, opciones)
+    informe = {
+        'entorno': {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+        },
+        'opciones': vars(opciones),
+        'resultados': resultados,
+    }
+    if opciones.salida:
+        with open(opciones.salida, 'w') as f:
+            json.dump(informe, f, indent=2)
+    
+    if opciones.base:
+        with open(opciones.base) as f:
+            base = json.load(f)
+        regresiones = comparar(resultados, base, opciones.tolerancia)
+        for (problema, algoritmo, tamano), antes, ahora in regresiones:
+            print(f"Regresión en {problema} {algoritmo} {tamano}: "
+                  f"{antes:.3f} s -> {'falló' if ahora is None else f'{ahora:.3f} s'}")
+        if regresiones:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -41,13 +41,23 @@ class CamionMagicoProb(MDP):
         elif a == 'usar_camion':
             return (self.rho if s_ == min(self.meta + 1, 2*s) else 
                     1 - self.rho if s_ == s else 0)
+    
+    def sucesores(self, s, a):
+        if s >= self.meta:
+            destinos = [(s, 1)]
+        elif a == 'caminar':
+            destinos = [(min(s + 1, self.meta + 1), 1)]
+        elif a == 'usar_camion':
+            destinos = [(min(self.meta + 1, 2*s), self.rho), (s, 1 - self.rho)]
+        return [(s_, p, self.recompensa(s, a, s_)) for s_, p in destinos]
                 
     def es_terminal(self, s):
         return False
     
-for rho in [0.01, 0.2, 0.4, 0.5, 0.6, 0.8, 0.99]:
-    print(f"Para rho = {rho}")
-    pi_star = iteracion_valor(CamionMagicoProb(0.9, rho, 145))
-    print(f"Los tramos donde se debe usar el camión son:")
-    print([s for s in pi_star if pi_star[s] == 'usar_camion'])
-    print("-"*50)
+if __name__ == "__main__":
+    for rho in [0.01, 0.2, 0.4, 0.5, 0.6, 0.8, 0.99]:
+        print(f"Para rho = {rho}")
+        pi_star = iteracion_valor(CamionMagicoProb(0.9, rho, 145))
+        print(f"Los tramos donde se debe usar el camión son:")
+        print([s for s in pi_star if pi_star[s] == 'usar_camion'])
+        print("-"*50)
@@ -3,8 +3,9 @@ El camión mágico, pero ahora por simulación
 
 """
 
-from RL import MDPsim, SARSA, Q_learning
-from random import random, randint
+from RL import MDPsim, FuenteAleatoria, SARSA, Q_learning
+
+import numpy as np
 
 class CamionMagico(MDPsim):
     """
@@ -18,15 +19,16 @@ class CamionMagico(MDPsim):
     
     """    
     
-    def __init__(self, gama, rho, meta):
+    def __init__(self, gama, rho, meta, rng=None):
         self.gama = gama
         self.rho = rho
         self.meta = meta
         self.estados = tuple(range(1, meta + 2))
+        self.rng = FuenteAleatoria() if rng is None else rng
     
     def estado_inicial(self):
-        #return randint(1, self.meta // 2 + 1)
-        return randint(1, self.meta - 1)
+        #return self.rng.randint(1, self.meta // 2 + 1)
+        return self.rng.randint(1, self.meta - 1)
     
     def acciones_legales(self, s):
         if s >= self.meta:
@@ -44,38 +46,57 @@ class CamionMagico(MDPsim):
         if a == 'caminar':
             return min(s + 1, self.meta + 1)
         elif a == 'usar_camion':
-            return min(self.meta + 1, 2*s) if random() < self.rho else s
+            return min(self.meta + 1, 2*s) if self.rng.random() < self.rho else s
         
     def es_terminal(self, s):
         return s >= self.meta
-
-mdp_sim = CamionMagico(
-    gama=0.999, rho=0.9, meta=145
-)
     
-Q_sarsa = SARSA(
-    mdp_sim, 
-    alfa=0.1, epsilon=0.02, n_ep=100_000, n_iter=50
-)
-pi_s = {s: max(
-    ['caminar', 'usar_camion'], key=lambda a: Q_sarsa[(s, a)]
-) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
-
-Q_ql = Q_learning(
-    mdp_sim, 
-    alfa=0.1, epsilon=0.02, n_ep=100_000, n_iter=1000
-)
-pi_ql = {s: max(
-    ['caminar', 'usar_camion'], key=lambda a: Q_ql[(s, a)]
-) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
-
-print(f"Los tramos donde se debe usar el camión segun SARSA son:")
-print([s for s in pi_s if pi_s[s] == 'usar_camion'])
-print("-"*50)
-print(f"Los tramos donde se debe usar el camión segun Qlearning son:")
-print([s for s in pi_ql if pi_ql[s] == 'usar_camion'])
-print("-"*50)
+    def estado_inicial_lote(self, n):
+        return self.rng.randint_lote(1, self.meta - 1, n)
+    
+    def recompensa_lote(self, S, A, S_):
+        return np.where(
+            S_ > self.meta, -100, np.where(
+            S_ == self.meta, 100, np.where(
+            A == 'caminar', -1, -2))
+        ).astype(float)
+    
+    def transicion_lote(self, S, A):
+        camion = np.where(
+            self.rng.random_lote(len(S)) < self.rho, np.minimum(self.meta + 1, 2*S), S
+        )
+        return np.where(A == 'caminar', np.minimum(S + 1, self.meta + 1), camion)
+    
+    def es_terminal_lote(self, S):
+        return S >= self.meta
 
+if __name__ == "__main__":
+    mdp_sim = CamionMagico(
+        gama=0.999, rho=0.9, meta=145
+    )
+    
+    Q_sarsa = SARSA(
+        mdp_sim, 
+        alfa=0.1, epsilon=0.02, n_ep=100_000, n_iter=50
+    )
+    pi_s = {s: max(
+        ['caminar', 'usar_camion'], key=lambda a: Q_sarsa[(s, a)]
+    ) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
+    
+    Q_ql = Q_learning(
+        mdp_sim, 
+        alfa=0.1, epsilon=0.02, n_ep=100_000, n_iter=1000
+    )
+    pi_ql = {s: max(
+        ['caminar', 'usar_camion'], key=lambda a: Q_ql[(s, a)]
+    ) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
+    
+    print(f"Los tramos donde se debe usar el camión segun SARSA son:")
+    print([s for s in pi_s if pi_s[s] == 'usar_camion'])
+    print("-"*50)
+    print(f"Los tramos donde se debe usar el camión segun Qlearning son:")
+    print([s for s in pi_ql if pi_ql[s] == 'usar_camion'])
+    print("-"*50)
 
 """
 **********************************************************************************
@@ -0,0 +1,235 @@
+"""
+Punto de entrada de línea de comandos para resolver los problemas de
+ejemplo sin ventanas ni salida interactiva.
+
+Se elige el problema, el algoritmo, los parámetros de cada uno y el formato
+de salida; el resultado es la política y el valor de cada estado no 
+terminal (en aprendizaje, el valor Q de la acción greedy). Por ejemplo:
+
+    python experimento.py gambler iteracion_valor -p meta=200 ph=0.4 \\
+        -o motor=numpy --formato json --salida pi.json
+    python experimento.py camion_magico_rl Q_lambda -o n_ep=2000 lamda=0.9 \\
+        --metricas episodios.csv --grafica politica.png
+
+Los valores de -p y -o se interpretan como literales de Python, y si no
+se pueden interpretar se toman como cadenas.
+
+"""
+import argparse
+import ast
+import csv
+import inspect
+import json
+import sys
+
+import MDPs
+import RL
+from metricas import Metricas
+
+# Problema: (módulo, clase, tipo, parámetros por omisión). Los módulos se
+# importan solo cuando se usan.
+PROBLEMAS = {
+    'gambler': ('gambler', 'Gambler', 'dp',
+                {'gama': 1, 'meta': 100, 'ph': 0.4}),
+    'camion_magico': ('camion_magico', 'CamionMagicoProb', 'dp',
+                      {'gama': 0.9, 'rho': 0.9, 'meta': 145}),
+    'jugador': ('gambler_rl', 'Jugador', 'rl',
+                {'meta': 100, 'ph': 0.4, 'gama': 1}),
+    'camion_magico_rl': ('camnion_magico_rl', 'CamionMagico', 'rl',
+                         {'gama': 0.999, 'rho': 0.9, 'meta': 145}),
+}
+
+# Algoritmo: opciones por omisión además de las que se den con -o
+ALGORITMOS = {
+    'dp': {
+        'iteracion_valor': {},
+        'iteracion_politica': {},
+        'iteracion_valor_prioritaria': {},
+        'iteracion_valor_componentes': {},
+        'iteracion_valor_multinivel': {},
+    },
+    'rl': {
+        'SARSA': {},
+        'Q_learning': {},
+        'SARSA_lambda': {'lamda': 0.9},
+        'Q_lambda': {'lamda': 0.9},
+        'Dyna_Q': {},
+        'Q_learning_repeticion': {},
+        'SARSA_lote': {},
+        'Q_learning_lote': {},
+    },
+}
+
+OPCIONES_RL = {'epsilon': 0.02, 'alfa': 0.1, 'n_ep': 10_000, 'n_iter': 1000}
+
+def construir(problema, parametros):
+    """
+    Construye el MDP del problema con los parámetros dados, que reemplazan
+    a los de omisión.
+    
+    """
+    omision = PROBLEMAS[problema][3]
+    return _clase(problema)(**{**omision, **parametros})
+
+def _clase(problema):
+    """
+    Importa y devuelve la clase del MDP del problema.
+    
+    """
+    from importlib import import_module
+    
+    modulo, clase = PROBLEMAS[problema][:2]
+    return getattr(import_module(modulo), clase)
+
+def _desconocidos(funcion, nombres, fijos=()):
+    """
+    Devuelve, ordenados, los nombres que no son argumentos de funcion o que
+    están en fijos (los que pone resolver).
+    
+    """
+    argumentos = inspect.signature(funcion).parameters
+    return sorted(n for n in nombres if n not in argumentos or n in fijos)
+
+def resolver(problema, algoritmo, parametros=None, opciones=None,
+             semilla=None, metricas=None):
+    """
+    Resuelve el problema con el algoritmo y devuelve una tupla (pi, V). En
+    los algoritmos de aprendizaje V[s] es Q(s, pi[s]).
+    
+    Parámetros:
+        problema: nombre en PROBLEMAS
+        algoritmo: nombre de una función de MDPs.py o RL.py en ALGORITMOS
+        parametros: diccionario de parámetros del problema
+        opciones: diccionario de opciones del algoritmo
+        semilla: semilla de las fuentes aleatorias (solo aprendizaje)
+        metricas: registro de métricas (ver metricas.py)
+    
+    """
+    tipo = PROBLEMAS[problema][2]
+    if algoritmo not in ALGORITMOS[tipo]:
+        raise ValueError(f"{algoritmo} no se aplica al problema {problema}")
+    mdp = construir(problema, parametros or {})
+    
+    if tipo == 'dp':
+        opciones = {**ALGORITMOS[tipo][algoritmo], **(opciones or {})}
+        pi, V = getattr(MDPs, algoritmo)(mdp, ver_V=True, metricas=metricas,
+                                         **opciones)
+        return pi, V
+    
+    opciones = {**OPCIONES_RL, **ALGORITMOS[tipo][algoritmo], **(opciones or {})}
+    fuente = RL.FuenteAleatoria(semilla)
+    mdp.rng, rng = fuente.engendrar(2)
+    Q = getattr(RL, algoritmo)(mdp, rng=rng, metricas=metricas, **opciones)
+    pi = Q.politica()
+    return pi, {s: Q[(s, a)] for s, a in pi.items()}
+
+def escribir(pi, V, formato, archivo):
+    """
+    Escribe la política y el valor en el formato 'texto', 'csv' o 'json'.
+    
+    """
+    filas = [(s, a, V[s]) for s, a in pi.items()]
+    if formato == 'json':
+        json.dump([{'estado': s, 'accion': a, 'valor': v} for s, a, v in filas],
+                  archivo, indent=1)
+        archivo.write('\n')
+    elif formato == 'csv':
+        escritor = csv.writer(archivo)
+        escritor.writerow(['estado', 'accion', 'valor'])
+        escritor.writerows(filas)
+    else:
+        archivo.write("Estado".center(12) + '|' + "Acción".center(14) + '|'
+                      + "Valor".center(14) + '\n')
+        archivo.write("-" * 12 + '|' + "-" * 14 + '|' + "-" * 14 + '\n')
+        for s, a, v in filas:
+            archivo.write(str(s).center(12) + '|' + str(a).center(14) + '|'
+                          + f"{v:.6g}".center(14) + '\n')
+
+def graficar(pi, archivo):
+    """
+    Guarda en archivo la gráfica de la política, sin abrir ventanas.
+    
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    
+    estados = list(pi)
+    figura, ejes = plt.subplots()
+    ejes.plot(estados, [pi[s] for s in estados], '*')
+    ejes.set_xlabel("Estado")
+    ejes.set_ylabel("Acción")
+    figura.savefig(archivo)
+    plt.close(figura)
+
+def _valores(pares):
+    """
+    Convierte una lista de 'nombre=valor' en diccionario.
+    
+    """
+    resultado = {}
+    for par in pares:
+        nombre, _, texto = par.partition('=')
+        try:
+            resultado[nombre] = ast.literal_eval(texto)
+        except (ValueError, SyntaxError):
+            resultado[nombre] = texto
+    return resultado
+
+def main(argv=None):
+    algoritmos = sorted({a for tipo in ALGORITMOS.values() for a in tipo})
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('problema', choices=list(PROBLEMAS))
+    parser.add_argument('algoritmo', choices=algoritmos)
+    parser.add_argument('-p', '--parametros', nargs='*', default=[],
+                        metavar='NOMBRE=VALOR', help="parámetros del problema")
+    parser.add_argument('-o', '--opciones', nargs='*', default=[],
+                        metavar='NOMBRE=VALOR', help="opciones del algoritmo")
+    parser.add_argument('--semilla', type=int)
+    parser.add_argument('--formato', choices=['texto', 'csv', 'json'],
+                        default='texto')
+    parser.add_argument('--salida', help="archivo de salida (por omisión la "
+                                         "salida estándar)")
+    parser.add_argument('--metricas', help="archivo CSV o JSON lines con las "
+                                           "métricas por iteración o episodio")
+    parser.add_argument('--grafica', help="archivo de imagen de la política")
+    args = parser.parse_args(argv)
+    
+    tipo = PROBLEMAS[args.problema][2]
+    if args.algoritmo not in ALGORITMOS[tipo]:
+        parser.error(f"{args.algoritmo} no se aplica al problema "
+                     f"{args.problema}")
+    parametros, opciones = _valores(args.parametros), _valores(args.opciones)
+    desconocidos = _desconocidos(_clase(args.problema), parametros)
+    if desconocidos:
+        parser.error(f"parámetros desconocidos para {args.problema}: "
+                     f"{', '.join(desconocidos)}")
+    funcion = getattr(MDPs if tipo == 'dp' else RL, args.algoritmo)
+    fijos = ('mdp', 'metricas') + (('ver_V',) if tipo == 'dp' else ('rng',))
+    desconocidos = _desconocidos(funcion, opciones, fijos)
+    if desconocidos:
+        parser.error(f"opciones no válidas para {args.algoritmo}: "
+                     f"{', '.join(desconocidos)}")
+    
+    metricas = Metricas(args.metricas, en_memoria=False) if args.metricas else None
+    try:
+        pi, V = resolver(args.problema, args.algoritmo, parametros, opciones,
+                         args.semilla, metricas)
+    finally:
+        if metricas is not None:
+            metricas.cerrar()
+    
+    if args.salida:
+        with open(args.salida, 'w', newline='') as archivo:
+            escribir(pi, V, args.formato, archivo)
+    else:
+        escribir(pi, V, args.formato, sys.stdout)
+    if args.grafica:
+        graficar(pi, args.grafica)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,7 +14,6 @@ se muestra que existen multiples soluciones y que no es nunca tan obvio como par
 """
 
 from MDPs import MDP, iteracion_valor
-from matplotlib import pyplot as plt
 
 class Gambler(MDP):
     """
@@ -45,16 +44,26 @@ class Gambler(MDP):
             return 1 if s_ == self.meta + 1 else 0
         return self.ph if s_ == s + a else 1.0 - self.ph if s_ == s - a else 0
     
+    def sucesores(self, s, a):
+        if s == 0 or s == self.meta + 1:
+            return []
+        if s == self.meta:
+            return [(self.meta + 1, 1, 1)]
+        return [(s + a, self.ph, 0), (s - a, 1.0 - self.ph, 0)]
+    
     def es_terminal(self, s):
         return s == 0 or s == self.meta + 1
 
-mdp = Gambler(gama=1, ph=0.5)    
-pi_star, V_star = iteracion_valor(
-    mdp, 
-    epsilon=1e-6, max_iter=10_000, ver_V=True, debug=True
-)
-
-plt.plot(range(1, 100), [pi_star[s] for s in range(1, 100)], '*')
-plt.xlabel("Capital")
-plt.ylabel("Apuesta")
-plt.show()
+if __name__ == "__main__":
+    from matplotlib import pyplot as plt
+    
+    mdp = Gambler(gama=1, ph=0.5)    
+    pi_star, V_star = iteracion_valor(
+        mdp, 
+        epsilon=1e-6, max_iter=10_000, ver_V=True, debug=True
+    )
+    
+    plt.plot(range(1, 100), [pi_star[s] for s in range(1, 100)], '*')
+    plt.xlabel("Capital")
+    plt.ylabel("Apuesta")
+    plt.show()
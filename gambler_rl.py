@@ -3,8 +3,9 @@ El problema del jugador pero como un problema de aprendizaje por refuerzo
 
 """
 
-from RL import MDPsim, SARSA, Q_learning
-from random import random, randint
+from RL import MDPsim, FuenteAleatoria, SARSA, Q_learning
+
+import numpy as np
 
 class Jugador(MDPsim):
     """
@@ -14,14 +15,15 @@ class Jugador(MDPsim):
     objetivo o quedarse sin dinero.
     
     """
-    def __init__(self, meta, ph, gama):
+    def __init__(self, meta, ph, gama, rng=None):
         self.estados = tuple(range(meta + 1))
         self.meta = meta
         self.ph = ph
         self.gama = gama
+        self.rng = FuenteAleatoria() if rng is None else rng
         
     def estado_inicial(self):
-        return randint(1, self.meta - 1)
+        return self.rng.randint(1, self.meta - 1)
     
     def acciones_legales(self, s):
         if s == 0 or s == self.meta:
@@ -32,39 +34,52 @@ class Jugador(MDPsim):
         return 1 if s_ == self.meta else 0
     
     def transicion(self, s, a):
-        return s + a if random() < self.ph else s - a
+        return s + a if self.rng.random() < self.ph else s - a
     
     def es_terminal(self, s):
         return s == 0 or s == self.meta
     
-mdp_sim = Jugador(
-    meta=100, ph=0.40, gama=1
-)
-
-Q_sarsa = SARSA(
-    mdp_sim, 
-    alfa=0.2, epsilon=0.02, n_ep=300_000, n_iter=50
-)
-pi_s = {s: max(
-    mdp_sim.acciones_legales(s), key=lambda a: Q_sarsa[(s, a)]
-) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
-
-Q_ql = Q_learning(
-    mdp_sim, 
-    alfa=0.2, epsilon=0.02, n_ep=300_000, n_iter=50
-)
-pi_q = {s: max(
-    mdp_sim.acciones_legales(s), key=lambda a: Q_ql[(s, a)]
-) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
-
-print("Estado".center(10) + '|' +  "SARSA".center(10) + '|' + "Q-learning".center(10))
-print("-"*10 + '|' + "-"*10 + '|' + "-"*10)
-for s in mdp_sim.estados:
-    if not mdp_sim.es_terminal(s):
-        print(str(s).center(10) + '|' 
-              + str(pi_s[s]).center(10) + '|' 
-              + str(pi_q[s]).center(10))
-print("-"*10 + '|' + "-"*10 + '|' + "-"*10)
+    def estado_inicial_lote(self, n):
+        return self.rng.randint_lote(1, self.meta - 1, n)
+    
+    def transicion_lote(self, S, A):
+        return np.where(self.rng.random_lote(len(S)) < self.ph, S + A, S - A)
+    
+    def recompensa_lote(self, S, A, S_):
+        return (S_ == self.meta).astype(float)
+    
+    def es_terminal_lote(self, S):
+        return (S == 0) | (S == self.meta)
+    
+if __name__ == "__main__":
+    mdp_sim = Jugador(
+        meta=100, ph=0.40, gama=1
+    )
+    
+    Q_sarsa = SARSA(
+        mdp_sim, 
+        alfa=0.2, epsilon=0.02, n_ep=300_000, n_iter=50
+    )
+    pi_s = {s: max(
+        mdp_sim.acciones_legales(s), key=lambda a: Q_sarsa[(s, a)]
+    ) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
+    
+    Q_ql = Q_learning(
+        mdp_sim, 
+        alfa=0.2, epsilon=0.02, n_ep=300_000, n_iter=50
+    )
+    pi_q = {s: max(
+        mdp_sim.acciones_legales(s), key=lambda a: Q_ql[(s, a)]
+    ) for s in mdp_sim.estados if not mdp_sim.es_terminal(s)}
+    
+    print("Estado".center(10) + '|' +  "SARSA".center(10) + '|' + "Q-learning".center(10))
+    print("-"*10 + '|' + "-"*10 + '|' + "-"*10)
+    for s in mdp_sim.estados:
+        if not mdp_sim.es_terminal(s):
+            print(str(s).center(10) + '|' 
+                  + str(pi_s[s]).center(10) + '|' 
+                  + str(pi_q[s]).center(10))
+    print("-"*10 + '|' + "-"*10 + '|' + "-"*10)
 
 """ 
 ***************************************************************************************
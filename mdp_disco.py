@@ -0,0 +1,271 @@
+"""
+MDPs demasiado grandes para la memoria: construcción del modelo en disco e
+iteración de valor por bloques sobre los arreglos mapeados.
+
+El modelo se guarda en el mismo formato CSR que MDPs.MDPCompilado, pero
+cada arreglo es un archivo binario que se escribe por pedazos mientras se
+recorren los estados y se lee con np.memmap. Solo V (un flotante por
+estado) y un bloque de transiciones a la vez necesitan estar en memoria.
+
+"""
+import json
+import os
+
+import numpy as np
+
+from persistencia import como_arreglo, como_lista
+
+# Arreglos del modelo: nombre -> tipo
+ARREGLOS = {
+    'inicio': np.int64,     # primer renglón (s, a) de cada estado (n + 1)
+    'accion': np.int32,     # código de la acción de cada renglón (s, a)
+    'R': np.float64,        # recompensa esperada de cada renglón (s, a)
+    'ptr': np.int64,        # primera transición de cada renglón (n_sa + 1)
+    'sucesor': np.int64,    # índice del estado siguiente de cada transición
+    'prob': np.float64,     # probabilidad de cada transición
+    'terminal': np.bool_,   # estados terminales (n)
+}
+
+class MDPDisco:
+    """
+    Modelo de un MDP guardado en disco por construir_en_disco.
+    
+    Atributos
+    ---------
+    directorio : str
+        Directorio del modelo.
+    n_estados, n_sa : int
+        Número de estados y de pares (s, a).
+    gama : float
+        Factor de descuento.
+    acciones : list
+        Acciones del MDP; accion[k] es la posición de la acción del
+        renglón k en esta lista.
+    estados : ndarray o None
+        Estados en el orden de su índice, o None si se construyó con
+        indice_estado (el índice es el estado).
+    inicio, accion, R, ptr, sucesor, prob, terminal : np.memmap
+        Arreglos del modelo (ver ARREGLOS), de solo lectura.
+    
+    """
+    def __init__(self, directorio):
+        self.directorio = os.fspath(directorio)
+        with open(os.path.join(self.directorio, 'meta.json')) as f:
+            meta = json.load(f)
+        self.n_estados, self.n_sa, self.gama = (
+            meta['n_estados'], meta['n_sa'], meta['gama'])
+        for nombre, tipo in ARREGLOS.items():
+            ruta = os.path.join(self.directorio, nombre + '.bin')
+            if os.path.getsize(ruta):
+                arreglo = np.memmap(ruta, dtype=tipo, mode='r')
+            else:
+                arreglo = np.zeros(0, dtype=tipo)
+            setattr(self, nombre, arreglo)
+        self.acciones = como_lista(np.load(
+            os.path.join(self.directorio, 'acciones.npy'), allow_pickle=True))
+        ruta = os.path.join(self.directorio, 'estados.npy')
+        self.estados = (np.load(ruta, mmap_mode='r')
+                        if meta['con_estados'] else None)
+    
+    def politica(self, codigos):
+        """
+        Convierte el arreglo de códigos que devuelve iteracion_valor_disco
+        en un diccionario {s: a}. Solo conviene cuando cabe en memoria.
+        
+        """
+        estados = (range(self.n_estados) if self.estados is None
+                   else como_lista(self.estados))
+        return {s: self.acciones[g] for s, g in zip(estados, codigos.tolist())
+                if g >= 0}
+
+def construir_en_disco(mdp, directorio, estados=None, indice_estado=None,
+                       tam_bloque=100_000):
+    """
+    Recorre el MDP estado por estado y escribe su modelo CSR en disco por
+    bloques, sin tener nunca el modelo completo en memoria.
+    
+    Parámetros
+    ----------
+    mdp : MDP
+        MDP a construir. Se usa sucesores(s, a), así que conviene que lo
+        implemente en lugar de solo prob_transicion.
+    directorio : str
+        Directorio donde se escribe el modelo; se crea si no existe.
+    estados : iterable
+        Estados en el orden de su índice. Si es None se usa mdp.estados;
+        para MDPs enormes conviene un generador o un range.
+    indice_estado : callable
+        Función que da el índice de un estado (por ejemplo s - 1 en el
+        camión mágico). Si es None se construye un diccionario con todos
+        los estados, que puede no caber en memoria; si se da, el estado en
+        la posición i debe tener índice i y los estados no se guardan.
+    tam_bloque : int
+        Número de estados que se acumulan antes de escribir.
+    
+    Devuelve
+    --------
+    modelo : MDPDisco
+        Modelo abierto con los arreglos mapeados.
+    
+    """
+    estados = mdp.estados if estados is None else estados
+    if indice_estado is None:
+        estados = list(estados)
+        indice = {s: i for i, s in enumerate(estados)}
+        indice_estado = indice.__getitem__
+        con_estados = True
+    else:
+        con_estados = False
+    
+    # meta.json es lo último que se escribe: sin él MDPDisco no abre el 
+    # directorio, así que se quita el de una construcción anterior antes de
+    # sobrescribir sus arreglos
+    os.makedirs(directorio, exist_ok=True)
+    meta = os.path.join(directorio, 'meta.json')
+    if os.path.exists(meta):
+        os.remove(meta)
+    archivos = {nombre: open(os.path.join(directorio, nombre + '.bin'), 'wb')
+                for nombre in ARREGLOS}
+    pendiente = {nombre: [] for nombre in ARREGLOS}
+    
+    def escribir():
+        for nombre, valores in pendiente.items():
+            archivos[nombre].write(
+                np.array(valores, dtype=ARREGLOS[nombre]).tobytes())
+            valores.clear()
+    
+    codigo = {}
+    n_estados = n_sa = nnz = 0
+    pendiente['inicio'].append(0)
+    pendiente['ptr'].append(0)
+    try:
+        for i, s in enumerate(estados):
+            if indice_estado(s) != i:
+                raise ValueError(f"El estado {s!r} no tiene el índice {i}")
+            terminal = mdp.es_terminal(s)
+            pendiente['terminal'].append(terminal)
+            for a in () if terminal else mdp.acciones_legales(s):
+                if a not in codigo:
+                    codigo[a] = len(codigo)
+                r_esperada = 0
+                for s_, p, r in mdp.sucesores(s, a):
+                    pendiente['sucesor'].append(indice_estado(s_))
+                    pendiente['prob'].append(p)
+                    r_esperada += p * r
+                    nnz += 1
+                pendiente['accion'].append(codigo[a])
+                pendiente['R'].append(r_esperada)
+                pendiente['ptr'].append(nnz)
+                n_sa += 1
+            pendiente['inicio'].append(n_sa)
+            n_estados += 1
+            if n_estados % tam_bloque == 0:
+                escribir()
+        escribir()
+    finally:
+        for archivo in archivos.values():
+            archivo.close()
+    
+    np.save(os.path.join(directorio, 'acciones.npy'),
+            como_arreglo(codigo), allow_pickle=True)
+    if con_estados:
+        np.save(os.path.join(directorio, 'estados.npy'),
+                como_arreglo(estados), allow_pickle=True)
+    with open(meta + '.tmp', 'w') as f:
+        json.dump({'n_estados': n_estados, 'n_sa': n_sa, 'gama': mdp.gama,
+                   'con_estados': con_estados}, f)
+    os.replace(meta + '.tmp', meta)
+    return MDPDisco(directorio)
+
+def iteracion_valor_disco(modelo, epsilon=1e-6, max_iter=1000, ver_V=False,
+                          tam_bloque=1_000_000, V0=None, metricas=None):
+    """
+    Iteración de valor sobre un modelo en disco, por bloques de estados.
+    
+    Cada barrido recorre los estados en bloques de tam_bloque: lee del
+    disco las transiciones del bloque, calcula sus valores Q con
+    operaciones vectorizadas y actualiza V en el lugar, así que los bloques
+    siguientes ya usan los valores nuevos (Gauss-Seidel por bloques). La
+    memoria residente es V más un bloque de transiciones.
+    
+    Parámetros
+    ----------
+    modelo : MDPDisco
+        Modelo construido con construir_en_disco.
+    epsilon : float
+        Criterio de convergencia.
+    max_iter : int
+        Número máximo de iteraciones.
+    ver_V : bool
+        Si es True, devuelve también la función de valor.
+    tam_bloque : int
+        Número de estados por bloque.
+    V0 : ndarray
+        Valor inicial por índice de estado. Si es None se empieza en cero.
+    metricas : Metricas
+        Registro de métricas por iteración (ver metricas.py). Opcional.
+    
+    Devuelve
+    --------
+    pi : ndarray
+        Código de la acción óptima de cada estado (-1 si no tiene
+        acciones); la acción es modelo.acciones[pi[i]].
+    
+    """
+    n = modelo.n_estados
+    V = np.zeros(n) if V0 is None else np.array(V0, dtype=float)
+    bloques = [(a, min(a + tam_bloque, n)) for a in range(0, n, tam_bloque)]
+    if metricas is not None:
+        metricas.iniciar()
+    
+    for it in range(max_iter):
+        delta = respaldos = 0
+        for a, b in bloques:
+            activos, maximo, _ = _respaldo_bloque(modelo, V, a, b)
+            if len(activos):
+                delta = max(delta, np.max(np.abs(maximo - V[activos])))
+                V[activos] = maximo
+                respaldos += len(activos)
+        if metricas is not None:
+            # Como en MDPs.py, un respaldo por estado con acciones
+            metricas.registrar('iteracion_valor_disco', it + 1,
+                               respaldos=respaldos, delta=float(delta))
+        if delta < epsilon:
+            break
+    
+    pi = np.full(n, -1, dtype=np.int64)
+    for a, b in bloques:
+        activos, _, mejor = _respaldo_bloque(modelo, V, a, b, argmax=True)
+        pi[activos] = modelo.accion[mejor]
+    return (pi, V) if ver_V else pi
+
+def _respaldo_bloque(modelo, V, a, b, argmax=False):
+    """
+    Respaldo de Bellman de los estados a:b. Devuelve los índices de los
+    estados con acciones, su valor máximo y, con argmax=True, el renglón
+    (s, a) de la primera acción que lo alcanza.
+    
+    """
+    inicio = np.asarray(modelo.inicio[a:b + 1])
+    sa0, sa1 = int(inicio[0]), int(inicio[-1])
+    if sa0 == sa1:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), None
+    ptr = np.asarray(modelo.ptr[sa0:sa1 + 1])
+    t0, t1 = int(ptr[0]), int(ptr[-1])
+    fila = np.repeat(np.arange(sa1 - sa0), np.diff(ptr))
+    esperado = np.bincount(
+        fila, weights=modelo.prob[t0:t1] * V[modelo.sucesor[t0:t1]],
+        minlength=sa1 - sa0
+    )
+    Q = modelo.R[sa0:sa1] + modelo.gama * esperado
+    
+    conteo = np.diff(inicio)
+    con_acciones = np.flatnonzero(conteo)
+    primeras = inicio[:-1][con_acciones] - sa0
+    maximo = np.maximum.reduceat(Q, primeras)
+    mejor = None
+    if argmax:
+        posiciones = np.where(Q == np.repeat(maximo, conteo[con_acciones]),
+                              np.arange(len(Q)), len(Q))
+        mejor = sa0 + np.minimum.reduceat(posiciones, primeras)
+    return a + con_acciones, maximo, mejor
@@ -0,0 +1,118 @@
+"""
+Registro de métricas para los algoritmos de MDPs.py y RL.py.
+
+Los algoritmos que aceptan el parámetro metricas llaman a
+metricas.iniciar() al empezar y a metricas.registrar(algoritmo, paso, ...)
+al final de cada iteración (programación dinámica) o episodio (aprendizaje
+por refuerzo). Cualquier objeto con esos dos métodos sirve; la clase
+Metricas guarda los registros en memoria y opcionalmente los escribe en un
+archivo CSV o JSON lines conforme llegan.
+
+Campos de cada registro:
+    algoritmo: nombre de la función que hace el registro
+    paso: número de iteración o de episodio, empezando en 1
+    tiempo: segundos desde el registro anterior (o desde iniciar)
+    respaldos: respaldos de Bellman de la iteración (programación dinámica)
+    delta: cambio máximo de V en la iteración (programación dinámica)
+    cambios: estados cuya acción cambió (mejora de iteración de política)
+    longitud: pasos del simulador en el episodio (aprendizaje)
+    retorno: suma de recompensas del episodio, sin descontar (aprendizaje)
+
+"""
+import csv
+import json
+from time import perf_counter
+
+CAMPOS = ('algoritmo', 'paso', 'tiempo', 'respaldos', 'delta', 'cambios',
+          'longitud', 'retorno')
+
+class Metricas:
+    """
+    Registro de métricas en memoria, con escritura opcional a un archivo.
+    
+    Atributos:
+        registros: lista de diccionarios, uno por iteración o episodio
+    
+    Se puede usar como administrador de contexto para cerrar el archivo:
+    
+        with Metricas('valor.csv') as metricas:
+            iteracion_valor(mdp, metricas=metricas)
+    
+    """
+    def __init__(self, archivo=None, formato=None, en_memoria=True):
+        """
+        Parámetros:
+            archivo: ruta del archivo donde se escriben los registros
+            formato: 'csv' o 'jsonl'; si es None se deduce de la extensión
+            en_memoria: si es False no se guardan los registros en la lista,
+                solo en el archivo, para corridas muy largas
+        
+        """
+        self.registros = []
+        self.en_memoria = en_memoria
+        self._archivo = self._escritor = None
+        if archivo is not None:
+            self._archivo = open(archivo, 'w', newline='')
+            self._escritor = _escritor(self._archivo, archivo, formato)
+        self._reloj = perf_counter()
+    
+    def iniciar(self):
+        """
+        Reinicia el reloj. Los algoritmos la llaman al empezar.
+        
+        """
+        self._reloj = perf_counter()
+    
+    def registrar(self, algoritmo, paso, **datos):
+        """
+        Agrega un registro con el tiempo transcurrido desde el anterior.
+        
+        """
+        ahora = perf_counter()
+        registro = {'algoritmo': algoritmo, 'paso': paso,
+                    'tiempo': ahora - self._reloj, **datos}
+        self._reloj = ahora
+        if self.en_memoria:
+            self.registros.append(registro)
+        if self._escritor is not None:
+            self._escritor(registro)
+    
+    def guardar(self, archivo, formato=None):
+        """
+        Escribe todos los registros guardados en memoria en un archivo.
+        
+        """
+        with open(archivo, 'w', newline='') as f:
+            escribir = _escritor(f, archivo, formato)
+            for registro in self.registros:
+                escribir(registro)
+    
+    def cerrar(self):
+        """
+        Cierra el archivo de salida, si hay uno.
+        
+        """
+        if self._archivo is not None:
+            self._archivo.close()
+            self._archivo = self._escritor = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+def _escritor(f, archivo, formato):
+    """
+    Devuelve una función que escribe un registro en el archivo abierto f.
+    
+    """
+    if formato is None:
+        formato = 'csv' if str(archivo).endswith('.csv') else 'jsonl'
+    if formato == 'csv':
+        escritor = csv.DictWriter(f, CAMPOS, extrasaction='ignore')
+        escritor.writeheader()
+        return escritor.writerow
+    elif formato == 'jsonl':
+        return lambda registro: f.write(json.dumps(registro) + '\n')
+    raise ValueError(f"Formato desconocido: {formato}")
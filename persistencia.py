@@ -0,0 +1,354 @@
+"""
+Persistencia compacta de funciones de valor, tablas Q y políticas, y puntos
+de control para reanudar los algoritmos largos.
+
+Cada objeto se guarda en un directorio con un archivo .npy por arreglo y un
+meta.json con los metadatos. Los .npy se pueden abrir con memoria mapeada,
+así que cargar una política o una tabla grande no copia nada hasta que se
+usa, y los estados y acciones se guardan como arreglos (índice -> estado)
+en lugar de diccionarios con llaves de tuplas.
+
+"""
+import json
+import os
+import shutil
+from collections.abc import Mapping
+
+import numpy as np
+
+FORMATO = 1
+
+def guardar(directorio, arreglos, metadatos=None):
+    """
+    Guarda un diccionario de arreglos y uno de metadatos (serializables en
+    JSON) en directorio. La escritura es atómica: se escribe en un
+    directorio temporal que después reemplaza al anterior, así que una
+    interrupción nunca deja un punto de control a medias. Si la 
+    interrupción llega entre quitar el anterior y poner el nuevo, cargar 
+    y PuntoControl.existe usan la copia que quedó (ver _vigente).
+    
+    Solo reemplaza o borra directorios que escribió guardar; si directorio
+    (o su .tmp o .old) es otra cosa lanza FileExistsError sin tocar nada.
+    
+    """
+    directorio = os.fspath(directorio)
+    _recuperar(directorio)
+    _comprobar(directorio)
+    temporal, anterior = directorio + '.tmp', directorio + '.old'
+    _comprobar(temporal)
+    _comprobar(anterior)
+    
+    _borrar(temporal)
+    os.makedirs(temporal)
+    # meta.json.tmp va primero, para que un temporal a medias se reconozca
+    # como de guardar, y se renombra a meta.json al final, así que un 
+    # directorio con meta.json siempre está completo
+    with open(os.path.join(temporal, 'meta.json.tmp'), 'w') as f:
+        json.dump({'formato': FORMATO, 'arreglos': list(arreglos),
+                   **(metadatos or {})}, f)
+    for nombre, arreglo in arreglos.items():
+        arreglo = np.asarray(arreglo)
+        np.save(os.path.join(temporal, nombre + '.npy'), arreglo,
+                allow_pickle=arreglo.dtype == object)
+    os.replace(os.path.join(temporal, 'meta.json.tmp'),
+               os.path.join(temporal, 'meta.json'))
+    
+    if os.path.exists(directorio):
+        _borrar(anterior)
+        os.replace(directorio, anterior)
+    os.replace(temporal, directorio)
+    _borrar(anterior)
+
+def _metadatos(ruta, nombre='meta.json'):
+    """
+    Devuelve el diccionario de metadatos de ruta si el archivo nombre
+    existe y es de guardar (tiene la clave 'formato'), y si no None.
+    
+    """
+    try:
+        with open(os.path.join(ruta, nombre)) as f:
+            metadatos = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(metadatos, dict) and 'formato' in metadatos:
+        return metadatos
+    return None
+
+def _comprobar(ruta):
+    """
+    Lanza FileExistsError si ruta existe y no es un directorio escrito por
+    guardar: completo (con meta.json), temporal a medias (con 
+    meta.json.tmp, que puede haber quedado cortado) o vacío.
+    
+    """
+    if not os.path.exists(ruta):
+        return
+    if os.path.isdir(ruta) and (
+            not os.listdir(ruta) or _metadatos(ruta) is not None or
+            os.path.isfile(os.path.join(ruta, 'meta.json.tmp'))):
+        return
+    raise FileExistsError(f"{ruta} existe y no fue escrito por guardar; "
+                          f"no se reemplaza")
+
+def _borrar(ruta):
+    """
+    Borra ruta si existe, después de comprobar que la escribió guardar.
+    
+    """
+    _comprobar(ruta)
+    if os.path.exists(ruta):
+        shutil.rmtree(ruta)
+
+def _vigente(directorio):
+    """
+    Devuelve el directorio completo más reciente de los que deja guardar:
+    directorio, o si una interrupción lo dejó a medio reemplazar, su .tmp
+    (escrito por completo, pues meta.json es lo último que se escribe) o
+    su .old. Devuelve None si no hay ninguno.
+    
+    """
+    for ruta in (directorio, directorio + '.tmp', directorio + '.old'):
+        if _metadatos(ruta) is not None:
+            return ruta
+    return None
+
+def _recuperar(directorio):
+    """
+    Si una interrupción de guardar dejó sin directorio, vuelve a ponerle
+    en su lugar la copia completa más reciente.
+    
+    """
+    if _metadatos(directorio) is not None:
+        return
+    ruta = _vigente(directorio)
+    if ruta is not None:
+        _borrar(directorio)
+        os.replace(ruta, directorio)
+
+def cargar(directorio, mmap=True):
+    """
+    Devuelve (arreglos, metadatos) de un directorio escrito con guardar.
+    Con mmap=True los arreglos numéricos se abren con memoria mapeada de
+    solo lectura.
+    
+    """
+    directorio = os.fspath(directorio)
+    ruta = _vigente(directorio)
+    if ruta is None:
+        raise FileNotFoundError(f"No hay datos guardados en {directorio}")
+    directorio = ruta
+    with open(os.path.join(directorio, 'meta.json')) as f:
+        metadatos = json.load(f)
+    if metadatos.get('formato') != FORMATO:
+        raise ValueError(f"Formato desconocido en {directorio}")
+    arreglos = {}
+    for nombre in metadatos['arreglos']:
+        ruta = os.path.join(directorio, nombre + '.npy')
+        try:
+            arreglos[nombre] = np.load(ruta, mmap_mode='r' if mmap else None)
+        except ValueError:
+            # Arreglos de objetos (estados que NumPy no puede representar)
+            arreglos[nombre] = np.load(ruta, allow_pickle=True)
+    return arreglos, metadatos
+
+def como_arreglo(valores):
+    """
+    Convierte una secuencia de estados o acciones en un arreglo compacto:
+    enteros o cadenas como vector, tuplas de números como matriz, y lo
+    demás como arreglo de objetos.
+    
+    """
+    valores = list(valores)
+    try:
+        arreglo = np.array(valores)
+    except ValueError:
+        arreglo = None
+    if arreglo is None or arreglo.dtype == object or arreglo.ndim > 2 or (
+            arreglo.ndim == 2 and not isinstance(valores[0], tuple)):
+        arreglo = np.empty(len(valores), dtype=object)
+        arreglo[:] = valores
+    return arreglo
+
+def como_lista(arreglo):
+    """
+    Inversa de como_arreglo: lista de estados o acciones de Python.
+    
+    """
+    if arreglo.ndim == 2:
+        return [tuple(fila) for fila in arreglo.tolist()]
+    return arreglo.tolist()
+
+def guardar_valor(directorio, V, pi=None, **metadatos):
+    """
+    Guarda una función de valor {s: V} y opcionalmente una política {s: a}.
+    
+    """
+    estados = list(V)
+    arreglos = {'estados': como_arreglo(estados),
+                'valores': np.array([V[s] for s in estados], dtype=float)}
+    if pi is not None:
+        acciones = list(dict.fromkeys(pi.values()))
+        codigo = {a: g for g, a in enumerate(acciones)}
+        arreglos['acciones'] = como_arreglo(acciones)
+        arreglos['politica'] = np.array(
+            [codigo[pi[s]] if s in pi else -1 for s in estados], dtype=np.int64
+        )
+    guardar(directorio, arreglos, metadatos)
+
+def cargar_valor(directorio):
+    """
+    Devuelve (V, pi) guardados con guardar_valor; pi es None si no se
+    guardó.
+    
+    """
+    arreglos, _ = cargar(directorio)
+    estados = como_lista(arreglos['estados'])
+    V = dict(zip(estados, arreglos['valores'].tolist()))
+    pi = None
+    if 'politica' in arreglos:
+        pi = dict(Politica(arreglos['estados'], arreglos['acciones'],
+                           arreglos['politica']))
+    return V, pi
+
+def guardar_Q(directorio, Q, **metadatos):
+    """
+    Guarda una QTabla con sus visitas y su política greedy, de modo que
+    cargar_politica pueda leer solo la política.
+    
+    """
+    arreglos = _arreglos_Q(Q)
+    guardar(directorio, arreglos, {'denso': Q.denso, **metadatos})
+
+def _arreglos_Q(Q):
+    mejor = np.array(Q.mejor, dtype=np.int64)
+    return {
+        'estados': como_arreglo(Q.estados),
+        'acciones': como_arreglo(Q.acciones),
+        'inicio': Q.inicio,
+        'columna': Q.columna,
+        'legal': Q.legal,
+        'valores': Q.arreglo,
+        'visitas': np.frombuffer(Q.visitas, dtype=np.int64),
+        'mejor': mejor,
+        'politica': np.where(mejor >= 0, Q.columna[mejor], -1),
+    }
+
+def cargar_Q(directorio):
+    """
+    Devuelve la QTabla guardada con guardar_Q.
+    
+    """
+    from RL import QTabla
+    
+    arreglos, metadatos = cargar(directorio)
+    Q = QTabla.desde_arreglos(
+        como_lista(arreglos['estados']), como_lista(arreglos['acciones']),
+        arreglos['inicio'], arreglos['columna'], arreglos['legal'],
+        arreglos['valores'], arreglos['visitas'], metadatos['denso']
+    )
+    Q.mejor[:] = arreglos['mejor'].tolist()
+    return Q
+
+def cargar_politica(directorio):
+    """
+    Devuelve la política guardada con guardar_valor o guardar_Q como un
+    objeto Politica sobre los arreglos mapeados en memoria.
+    
+    """
+    arreglos, _ = cargar(directorio)
+    return Politica(arreglos['estados'], arreglos['acciones'],
+                    arreglos['politica'])
+
+class Politica(Mapping):
+    """
+    Política {s: a} guardada en arreglos: estados, acciones y el código de
+    la acción de cada estado (-1 si no tiene). Se comporta como un
+    diccionario de solo lectura.
+    
+    El índice estado -> renglón se construye la primera vez que se consulta
+    un estado; accion(i) no lo necesita.
+    
+    """
+    def __init__(self, estados, acciones, codigos):
+        self.estados, self.codigos = estados, codigos
+        self.acciones = como_lista(acciones)
+        self._indice = None
+    
+    def accion(self, i):
+        """
+        Devuelve la acción del estado en el renglón i (None si no tiene).
+        
+        """
+        g = int(self.codigos[i])
+        return self.acciones[g] if g >= 0 else None
+    
+    def _renglon(self, s):
+        if self._indice is None:
+            self._indice = {s: i for i, s in 
+                            enumerate(como_lista(self.estados))}
+        return self._indice[s]
+    
+    def __getitem__(self, s):
+        a = self.accion(self._renglon(s))
+        if a is None:
+            raise KeyError(s)
+        return a
+    
+    def __iter__(self):
+        estados = como_lista(self.estados)
+        return (estados[i] for i in np.flatnonzero(np.asarray(self.codigos) >= 0))
+    
+    def __len__(self):
+        return int(np.count_nonzero(np.asarray(self.codigos) >= 0))
+
+class PuntoControl:
+    """
+    Punto de control de un algoritmo largo.
+    
+    Los algoritmos que aceptan el parámetro punto_control guardan su estado
+    completo en directorio cada cada iteraciones o episodios: V o Q, el
+    contador y el estado de las fuentes aleatorias. Si al empezar ya hay un
+    punto de control en directorio, el algoritmo continúa desde él y
+    obtiene exactamente el mismo resultado que sin la interrupción.
+    
+    """
+    def __init__(self, directorio, cada=100):
+        """
+        Parámetros:
+            directorio: directorio del punto de control
+            cada: iteraciones o episodios entre puntos de control
+        
+        """
+        self.directorio = os.fspath(directorio)
+        self.cada = cada
+    
+    def existe(self):
+        """
+        True si hay un punto de control que cargar. Lanza FileExistsError 
+        si directorio es otra cosa, antes de empezar y no al primer guardado.
+        
+        """
+        _comprobar(self.directorio)
+        return _vigente(self.directorio) is not None
+    
+    def toca(self, paso):
+        """
+        True si después del paso (contando desde 1) hay que guardar.
+        
+        """
+        return paso % self.cada == 0
+    
+    def guardar(self, arreglos, metadatos):
+        guardar(self.directorio, arreglos, metadatos)
+    
+    def cargar(self, algoritmo):
+        """
+        Devuelve (arreglos, metadatos) en memoria, listos para modificarse.
+        Falla si el punto de control es de otro algoritmo.
+        
+        """
+        arreglos, metadatos = cargar(self.directorio, mmap=False)
+        if metadatos.get('algoritmo') != algoritmo:
+            raise ValueError(f"El punto de control en {self.directorio} es "
+                             f"de {metadatos.get('algoritmo')}, no de {algoritmo}")
+        return arreglos, metadatos